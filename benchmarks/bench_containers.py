@@ -0,0 +1,32 @@
+"""Benchmark dumping and loading large !!omap, !!set, and !!python/* values.
+
+Run with:  python benchmarks/bench_containers.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import collections
+import timeit
+
+from camel import Camel, PYTHON_TYPES
+
+
+def main(size=20000, number=3):
+    values = {
+        'omap': collections.OrderedDict(
+            ('key{0}'.format(i), i) for i in range(size)),
+        'set': frozenset(range(size)),
+        'python/tuple': tuple(range(size)),
+        'python/frozenset': frozenset('item{0}'.format(i) for i in range(size)),
+    }
+    camel = Camel([PYTHON_TYPES])
+
+    for name, value in values.items():
+        dumped = camel.dump(value)
+        dump_time = timeit.timeit(lambda: camel.dump(value), number=number)
+        load_time = timeit.timeit(lambda: camel.load(dumped), number=number)
+        print("{0:>20}  dump {1:8.1f} ms  load {2:8.1f} ms".format(
+            name, dump_time / number * 1000, load_time / number * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Compare how much memory a forked child dirties while reading every value of
+a large document, loaded normally versus with `Camel.load_frozen`.
+
+Linux only, since it reads /proc/self/smaps_rollup.
+
+Run with:  python benchmarks/bench_frozen.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+from collections.abc import Mapping, Sequence
+import gc
+import os
+
+from camel import Camel
+
+
+def private_dirty_kb():
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            if line.startswith('Private_Dirty:'):
+                return int(line.split()[1])
+    return 0
+
+
+def walk(value):
+    if isinstance(value, Mapping):
+        for key in value:
+            walk(value[key])
+    elif isinstance(value, Sequence) and not isinstance(value, str):
+        for item in value:
+            walk(item)
+
+
+def measure_child(root):
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        before = private_dirty_kb()
+        walk(root)
+        after = private_dirty_kb()
+        os.write(write_fd, str(after - before).encode('ascii'))
+        os._exit(0)
+
+    os.close(write_fd)
+    result = int(os.read(read_fd, 100))
+    os.waitpid(pid, 0)
+    return result
+
+
+def main(size=100000):
+    camel = Camel()
+    document = camel.dump([
+        {'id': i, 'name': 'item{0}'.format(i), 'tags': ['red', 'green']}
+        for i in range(size)])
+    loaded = camel.load(document)
+    # Keep the GC from touching everything in the child, to be fair
+    gc.freeze()
+    print("load:        child dirtied {0:8} kB".format(measure_child(loaded)))
+    del loaded
+
+    frozen = camel.load_frozen(document)
+    print("load_frozen: child dirtied {0:8} kB  (buffer is {1} kB)".format(
+        measure_child(frozen.root), len(frozen.buffer) // 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Compare checkpointing a large, mostly unchanging state object with
+`Camel.dump` against an `IncrementalDumper`, touching one section per dump.
+
+Run with:  python benchmarks/bench_incremental.py
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import timeit
+
+from camel import Camel, CamelRegistry
+
+
+reg = CamelRegistry()
+
+
+class Section(object):
+    def __init__(self, name, entries):
+        self.name = name
+        self.entries = entries
+        self.camel_version = 0
+
+
+@reg.dumper(Section, 'section', version=1)
+def _dump_section(section):
+    return dict(name=section.name, entries=section.entries)
+
+
+def make_state(sections, entries):
+    return dict(
+        ('section{0}'.format(i), Section('section {0}'.format(i), [
+            dict(id=j, label='entry {0}'.format(j), weights=[0.5, 1.5, j])
+            for j in range(entries)
+        ]))
+        for i in range(sections))
+
+
+def main(sections=50, entries=200, rounds=20):
+    camel = Camel([reg])
+    state = make_state(sections, entries)
+    names = sorted(state)
+    dumper = camel.incremental_dumper()
+    assert dumper.dump(state) == camel.dump(state)
+
+    counter = [0]
+
+    def touch():
+        section = state[names[counter[0] % len(names)]]
+        section.entries[0]['id'] += 1
+        section.camel_version += 1
+        counter[0] += 1
+
+    def incremental():
+        touch()
+        dumper.dump(state)
+
+    def full():
+        touch()
+        camel.dump(state)
+
+    print("{0} sections of {1} entries, {2:.1f} MB of YAML".format(
+        sections, entries, len(camel.dump(state)) / 1e6))
+    full_time = min(timeit.repeat(full, number=1, repeat=rounds))
+    incremental_time = min(timeit.repeat(incremental, number=1, repeat=rounds))
+    print("  full dump         {0:8.2f} ms".format(full_time * 1000))
+    print("  incremental dump  {0:8.2f} ms  ({1:.0f}x)".format(
+        incremental_time * 1000, full_time / incremental_time))
+    assert dumper.dump(state) == camel.dump(state)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Report memory used by loading a corpus of similar records, with and without
+string interning.
+
+Run with:  python benchmarks/bench_intern.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import gc
+import tracemalloc
+
+from camel import Camel
+
+
+STATUSES = ['active', 'inactive', 'pending', 'banned']
+REGIONS = ['north-america', 'south-america', 'europe', 'asia-pacific']
+
+
+def make_corpus(size):
+    lines = []
+    for i in range(size):
+        lines.append(
+            "- id: {0}\n"
+            "  username: user{0}\n"
+            "  status: {1}\n"
+            "  region: {2}\n"
+            "  plan: {3}\n"
+            "  created: 2015-10-{4:02}\n"
+            .format(
+                i, STATUSES[i % 4], REGIONS[i % 3],
+                'premium' if i % 5 else 'basic', i % 28 + 1))
+    return ''.join(lines)
+
+
+def measure(camel, corpus, **kwargs):
+    gc.collect()
+    tracemalloc.start()
+    data = camel.load(corpus, **kwargs)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    return current
+
+
+def main(size=50000):
+    corpus = make_corpus(size)
+    camel = Camel()
+    baseline = measure(camel, corpus)
+    print("{0} records, {1:.1f} MB of YAML".format(size, len(corpus) / 1e6))
+    for intern in (None, 'keys', 'all'):
+        used = measure(camel, corpus, intern=intern)
+        print("  intern={0!r:8}  {1:8.1f} MB  ({2:+.1f}%)".format(
+            intern, used / 1e6, (used - baseline) / baseline * 100))
+
+
+if __name__ == '__main__':
+    main()
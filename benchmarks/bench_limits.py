@@ -0,0 +1,56 @@
+"""Benchmark the overhead of resource limits when loading ordinary documents,
+and of Camel's loader over pyyaml's own.
+
+Run with:  python benchmarks/bench_limits.py
+"""
+from __future__ import print_function
+from __future__ import unicode_literals
+import timeit
+
+import yaml
+
+from camel import Camel
+
+
+def make_document(size):
+    return Camel().dump([
+        {
+            'id': i,
+            'name': 'item{0}'.format(i),
+            'tags': ['red', 'green', 'blue'],
+            'dimensions': {'width': i % 7, 'height': i % 11},
+        }
+        for i in range(size)
+    ])
+
+
+def main(size=2000, rounds=15):
+    document = make_document(size)
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    cases = [
+        ("pyyaml", lambda data: yaml.load(data, Loader=loader)),
+        ("no limits", Camel().load),
+        ("string hints", Camel(string_hints=['id', 'name']).load),
+        ("bytes + nodes", Camel(max_bytes=10 ** 9, max_nodes=10 ** 9).load),
+        ("depth + aliases", Camel(
+            max_depth=1000, max_alias_expansion=10 ** 9).load),
+        ("all limits", Camel(
+            max_bytes=10 ** 9, max_nodes=10 ** 9,
+            max_depth=1000, max_alias_expansion=10 ** 9).load),
+    ]
+
+    # Interleave the cases and keep the best time for each, since anything
+    # slower is just noise
+    best = [float('inf')] * len(cases)
+    for _ in range(rounds):
+        for i, (_, load) in enumerate(cases):
+            elapsed = timeit.timeit(lambda: load(document), number=1)
+            best[i] = min(best[i], elapsed)
+
+    for (name, _), elapsed in zip(cases, best):
+        print("{0:>16}  {1:8.1f} ms  ({2:+.1f}%)".format(
+            name, elapsed * 1000, (elapsed - best[0]) / best[0] * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -15,27 +15,39 @@
 # - consider using (optionally?) ruamel.yaml, which roundtrips comments, merges, anchors, ...
 # - DWIM formatting: block style except for very short sequences (if at all?), quotey style for long text...
 # - make dumper/loader work on methods?  ehh
-# - "raw" loaders and dumpers that get to deal with raw yaml nodes?
 
 
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
-import base64
 import collections
+import contextlib
 import functools
+import io
 from io import StringIO
+import os
+import struct
+import sys
+import time
 import types
 
-import yaml
+# yaml, and everything built on it, isn't imported until it's needed, since
+# it's most of what importing camel costs; see _load_backend.  The same goes
+# for the stdlib modules only used by one feature each, which are imported
+# where they're used
+yaml = None
 
 try:
-    from yaml import CSafeDumper as SafeDumper
-    from yaml import CSafeLoader as SafeLoader
+    from collections.abc import Mapping, Sequence
 except ImportError:
-    from yaml import SafeDumper
-    from yaml import SafeLoader
+    from collections import Mapping, Sequence
+
+try:
+    _replace_file = os.replace
+except AttributeError:
+    # Python 2; not atomic on Windows, but there's no better option
+    _replace_file = os.rename
 
 
 YAML_TAG_PREFIX = 'tag:yaml.org,2002:'
@@ -44,133 +56,1787 @@ _str = type('')
 _bytes = type(b'')
 _long = type(18446744073709551617)  # 2**64 + 1
 
+# Default maximum number of distinct strings remembered when interning
+INTERN_LIMIT = 65536
+# Default minimum size, in nodes, of a subtree that gets deduplicated on dump
+DEDUPE_THRESHOLD = 4
+
+_clock = getattr(time, 'perf_counter', time.time)
+# Python 3.6+; turns pathlib paths and the like into plain strings
+_fspath = getattr(os, 'fspath', None)
+
+# Everything camel._backend provides to this module
+_BACKEND_NAMES = (
+    'SafeDumper', 'SafeLoader', 'CamelDumper', 'CamelLoader', 'LimitExceeded',
+    '_SharedNodes')
+
 
-class CamelDumper(SafeDumper):
-    """Subclass of yaml's `SafeDumper` that scopes representers to the
-    instance, rather than to the particular class, because damn.
+def _load_backend():
+    """Import yaml, and the classes built on it, into this module.  Called by
+    anything that needs them, starting with `Camel`'s constructor.
     """
-    def __init__(self, *args, **kwargs):
-        # TODO this isn't quite good enough; pyyaml still escapes anything
-        # outside the BMP
-        kwargs.setdefault('allow_unicode', True)
-        super(CamelDumper, self).__init__(*args, **kwargs)
-        self.yaml_representers = SafeDumper.yaml_representers.copy()
-        self.yaml_multi_representers = SafeDumper.yaml_multi_representers.copy()
+    global yaml
+    if yaml is not None:
+        return
+    from camel import _backend
+    namespace = globals()
+    for name in _BACKEND_NAMES:
+        namespace[name] = getattr(_backend, name)
+    yaml = _backend.yaml
+
+
+class _LazyRegex(object):
+    """A regex that isn't compiled until it's first used.  Some of ours are
+    slow to compile, and plenty of programs never use them.
+    """
+    def __init__(self, pattern, flags=0):
+        self.pattern = pattern
+        self.flags = flags
 
-        # Always dump bytes as binary, even on Python 2
-        self.add_representer(bytes, CamelDumper.represent_binary)
+    def __getattr__(self, name):
+        import re
+        value = getattr(re.compile(self.pattern, self.flags), name)
+        # Remember the method, so this isn't called again
+        setattr(self, name, value)
+        return value
+
+
+def __getattr__(name):
+    # Python 3.7+ only; makes `from camel import CamelLoader` and friends
+    # work before the backend has been loaded
+    if name in _BACKEND_NAMES:
+        _load_backend()
+        return globals()[name]
+    raise AttributeError(
+        "module {0!r} has no attribute {1!r}".format(__name__, name))
+
+
+def _open_gzip(fileobj, mode):
+    import gzip
+    return gzip.GzipFile(fileobj=fileobj, mode=mode)
+
+
+def _open_bz2(fileobj, mode):
+    import bz2
+    return bz2.BZ2File(fileobj, mode=mode)
+
+
+def _open_lzma(fileobj, mode):
+    try:
+        import lzma
+    except ImportError:
+        raise ValueError("lzma compression isn't available")
+    return lzma.LZMAFile(fileobj, mode=mode)
+
+
+# compression => (magic bytes, file extensions, function to wrap a file)
+_COMPRESSIONS = collections.OrderedDict([
+    ('gzip', (b'\x1f\x8b', ('.gz', '.gzip'), _open_gzip)),
+    ('bz2', (b'BZh', ('.bz2',), _open_bz2)),
+    ('lzma', (b'\xfd7zXZ\x00', ('.xz', '.lzma'), _open_lzma)),
+])
+
+
+def _sniff_compression(fileobj):
+    """Guess the compression of a binary file from its first few bytes,
+    without consuming them.
+    """
+    if hasattr(fileobj, 'peek'):
+        head = fileobj.peek(6)[:6]
+    else:
+        pos = fileobj.tell()
+        head = fileobj.read(6)
+        fileobj.seek(pos)
+
+    for compression, (magic, _, _) in _COMPRESSIONS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+@contextlib.contextmanager
+def _compressed_file(file, mode, compression):
+    """Open `file`, either a path or a binary file object, and yield a binary
+    file object that transparently compresses or decompresses it.
+
+    With `compression='auto'`, reading sniffs the file contents, and writing
+    goes by the path's extension.  A file object given to us is never closed.
+    """
+    if _fspath is not None and hasattr(file, '__fspath__'):
+        file = _fspath(file)
+    if isinstance(file, io.TextIOBase):
+        raise TypeError(
+            "Expected a path or a binary file object; got a text stream")
+
+    if isinstance(file, (_str, _bytes)):
+        if compression == 'auto' and mode == 'wb':
+            compression = None
+            for name, (_, extensions, _) in _COMPRESSIONS.items():
+                if isinstance(file, _str) and file.endswith(extensions):
+                    compression = name
+                    break
+        fileobj = io.open(file, mode)
+        owned = True
+    else:
+        if compression == 'auto' and mode == 'wb':
+            compression = None
+        fileobj = file
+        owned = False
+
+    buffered = None
+    try:
+        if compression == 'auto':
+            if not hasattr(fileobj, 'peek') and not fileobj.seekable():
+                # Pipes and the like; buffer them so the start can be peeked
+                # at without losing it
+                fileobj = buffered = io.BufferedReader(fileobj)
+            compression = _sniff_compression(fileobj)
+        if compression is None:
+            yield fileobj
+            return
+        if compression not in _COMPRESSIONS:
+            raise ValueError(
+                "Unknown compression {0!r}; expected one of {1}"
+                .format(compression, ', '.join(_COMPRESSIONS)))
+
+        wrapped = _COMPRESSIONS[compression][2](fileobj, mode)
+        try:
+            yield wrapped
+        finally:
+            # Doesn't close the underlying file
+            wrapped.close()
+    finally:
+        if buffered is not None:
+            # Closing or collecting the buffer would close the file under it
+            fileobj = buffered.detach()
+        if owned:
+            fileobj.close()
+
+
+# JSON is (nearly) valid YAML, so documents that happen to be JSON can be
+# parsed much faster by the json module.  These are the places where pyyaml
+# and json disagree, which mean we have to fall back to doing it properly.
+# YAML doesn't allow tabs outside of a flow collection, so don't allow them
+# before or after the top-level one
+_json_start_rx = _LazyRegex(r'[ \r\n]*[\[{]')
+# Characters pyyaml rejects or treats specially (\x85, \u2028, and \u2029 are
+# line breaks), and surrogate escapes, which pyyaml refuses
+_json_unsafe_rx = _LazyRegex(
+    '[^\x09\x0A\x0D\x20-\x7E\xA0-\u2027\u202A-\uD7FF\uE000-\uFFFD'
+    '\U00010000-\U0010ffff]'
+    '|\\\\u[dD][89abAB]')
+# pyyaml only takes a key that's on the same line as its colon, and no more
+# than 1024 characters before it.  Rather than measure the whitespace, give up
+# on any before a colon.  Only works once escapes are blanked out, so that
+# quotes always start or end a string
+_json_key_rx = _LazyRegex(r'"(?:[ \t\r\n]+|[^"]{1023,}"):')
+# json accepts floats like 1e5 or 1.5e10, but YAML 1.1 wants a decimal point
+# and a signed exponent, and considers anything else a string
+_yaml_float_rx = _LazyRegex(r'-?[0-9]+\.[0-9]*(?:[eE][-+][0-9]+)?$')
+# Tags whose constructors the json module effectively replaces
+_JSON_TAGS = [
+    YAML_TAG_PREFIX + name
+    for name in ('null', 'bool', 'int', 'float', 'str', 'seq', 'map')]
+
+
+class _NotJSON(Exception):
+    pass
+
+
+def _parse_json_float(value):
+    if not _yaml_float_rx.match(value):
+        raise _NotJSON
+    return float(value)
+
+
+def _load_json(data):
+    """Try to load `data` as JSON, in a way that's guaranteed to produce the
+    same result as loading it as YAML.  Raises `_NotJSON` if that's not
+    possible.
+    """
+    import json
+
+    if (not isinstance(data, _str)
+            or not _json_start_rx.match(data)
+            or data.rstrip(' \r\n')[-1:] not in (']', '}')):
+        raise _NotJSON
+    if _json_unsafe_rx.search(data):
+        raise _NotJSON
+    keys = data
+    if '\\' in data:
+        keys = data.replace('\\\\', '__').replace('\\"', '__')
+    if _json_key_rx.search(keys):
+        raise _NotJSON
+
+    try:
+        return json.loads(
+            data, parse_float=_parse_json_float,
+            parse_constant=_reject_json_constant)
+    except (ValueError, RuntimeError):
+        # Includes bad JSON and very deep nesting
+        raise _NotJSON
+
+
+def _reject_json_constant(value):
+    # NaN, Infinity, -Infinity; YAML spells these differently
+    raise _NotJSON
+
+
+# Patching a single value in a document works from parser events alone: the
+# marks on each event give the character range of the original text, so only
+# the new value needs dumping, and everything else (comments included) is
+# copied through untouched
+_PATCH_WIDTH = 2 ** 30
+
+
+def _skip_node(loader):
+    """Consume the events for one whole node."""
+    depth = 0
+    while True:
+        event = loader.get_event()
+        if isinstance(event, yaml.CollectionStartEvent):
+            depth += 1
+        elif isinstance(event, yaml.CollectionEndEvent):
+            depth -= 1
+        if depth == 0:
+            return
+
+
+def _find_patch_span(loader, path):
+    """Walk the events of the first document in `loader` to the node at
+    `path`, a sequence of mapping keys and sequence indices.  Only the keys
+    along the way are constructed.
+
+    Returns ``(start, end, first_event, key_event)``: the range of characters
+    the node's text covers, the node's own first event, and the event for its
+    key, if it's a mapping value.
+    """
+    loader.get_event()  # StreamStart
+    if not loader.check_event(yaml.DocumentStartEvent):
+        raise ValueError("Can't patch an empty stream")
+    loader.get_event()
+
+    key_event = None
+    for step in path:
+        event = loader.get_event()
+        if isinstance(event, yaml.MappingStartEvent):
+            while True:
+                if loader.check_event(yaml.MappingEndEvent):
+                    raise KeyError(step)
+                candidate = loader.peek_event()
+                if isinstance(candidate, yaml.ScalarEvent):
+                    loader.get_event()
+                    tag = candidate.tag
+                    if tag is None or tag == '!':
+                        tag = loader.resolve(
+                            yaml.ScalarNode, candidate.value, candidate.implicit)
+                    key = loader.construct_object(
+                        yaml.ScalarNode(tag, candidate.value), deep=True)
+                    if key == step:
+                        key_event = candidate
+                        break
+                else:
+                    # A collection or alias can't be a key we can name
+                    _skip_node(loader)
+                _skip_node(loader)
+        elif isinstance(event, yaml.SequenceStartEvent):
+            if not isinstance(step, int) or isinstance(step, bool) or step < 0:
+                raise IndexError(step)
+            for _ in range(step):
+                if loader.check_event(yaml.SequenceEndEvent):
+                    raise IndexError(step)
+                _skip_node(loader)
+            if loader.check_event(yaml.SequenceEndEvent):
+                raise IndexError(step)
+            key_event = None
+        elif isinstance(event, yaml.AliasEvent):
+            raise ValueError(
+                "Can't patch through an alias: {!r}".format(event.anchor))
+        else:
+            raise KeyError(step)
+
+    # Find the end of the node's own text.  Block collections don't end until
+    # the next token, which might be a line or several later (with comments in
+    # between), so use the end of their last child instead
+    first = loader.peek_event()
+    start = first.start_mark.index
+    end = start
+    flow_styles = []
+    while True:
+        event = loader.get_event()
+        if getattr(event, 'anchor', None) is not None and not isinstance(
+                event, yaml.AliasEvent):
+            raise ValueError(
+                "Can't patch over an anchor: {!r}".format(event.anchor))
+        if isinstance(event, yaml.CollectionStartEvent):
+            flow_styles.append(event.flow_style)
+            end = event.end_mark.index
+        elif isinstance(event, yaml.CollectionEndEvent):
+            if flow_styles.pop():
+                end = event.end_mark.index
+        else:
+            end = event.end_mark.index
+        if not flow_styles:
+            break
+
+    return start, end, first, key_event
+
+
+def _indent_fragment(fragment, indent):
+    """Reindent the continuation lines of a multi-line flow fragment, so they
+    sit further in than the block they're being spliced into.  They're only
+    ever the insides of quoted scalars, where leading whitespace is ignored.
+    """
+    lines = fragment.split('\n')
+    return '\n'.join(
+        [lines[0]] + [' ' * indent + line.lstrip(' ') for line in lines[1:]])
 
-    def represent_binary(self, data):
-        # This is copy-pasted, because it only exists in pyyaml in python 3 (?!)
-        if hasattr(base64, 'encodebytes'):
-            data = base64.encodebytes(data).decode('ascii')
+
+def _trailing_whitespace(text):
+    # A block scalar's end mark is past its trailing line breaks, which
+    # belong to whatever comes next; any other node's text never ends in
+    # whitespace, so this is always empty for them
+    return text[len(text.rstrip(' \t\r\n')):]
+
+
+def _copy_chars(source, dest, count, chunk_size=65536):
+    """Copy `count` characters from one text stream to another, or just skip
+    them if `dest` is None.  Returns the whitespace the copied text ended
+    with; see `_trailing_whitespace`.
+    """
+    tail = ''
+    while count > 0:
+        chunk = source.read(min(count, chunk_size))
+        if not chunk:
+            break
+        if dest is not None:
+            dest.write(chunk)
+        count -= len(chunk)
+        trailing = _trailing_whitespace(chunk)
+        if len(trailing) == len(chunk):
+            tail += chunk
         else:
-            data = base64.encodestring(data).decode('ascii')
-        return self.represent_scalar(
-            YAML_TAG_PREFIX + 'binary', data, style='|')
+            tail = trailing
+    return tail
+
+
+class _LoaderIndex(object):
+    """All the constructors from a set of registries, merged together.
+
+    Quacks enough like a loader for `CamelRegistry.inject_loaders` to fill it
+    in, and then every loader made from it just copies the result.  Two
+    registries may not load the same tag, since there'd be no way to tell
+    which one was intended; the exception is `STANDARD_TYPES`, which any
+    other registry may override.
+    """
+    def __init__(self, registries):
+        self.constructors = SafeLoader.yaml_constructors.copy()
+        self.multi_constructors = SafeLoader.yaml_multi_constructors.copy()
+        # (is multi, tag) => registry that added it
+        self._owners = {}
+        self._registry = None
+
+        for registry in registries:
+            self._registry = registry
+            registry.inject_loaders(self)
+        self._registry = None
+
+    def _claim(self, is_multi, tag):
+        owner = self._owners.get((is_multi, tag))
+        if owner not in (None, self._registry, STANDARD_TYPES):
+            raise ValueError(
+                "Conflicting loaders: tag {!r} is loaded by both {!r} and {!r}"
+                .format(tag, owner, self._registry))
+        self._owners[is_multi, tag] = self._registry
+
+    def add_constructor(self, tag, constructor):
+        self._claim(False, tag)
+        self.constructors[tag] = constructor
+
+    def add_multi_constructor(self, tag, constructor):
+        self._claim(True, tag)
+        self.multi_constructors[tag] = constructor
+
+
+class _DumperIndex(object):
+    """All the representers from a set of registries, merged together, for a
+    particular set of version locks.
+
+    Unlike loading, later registries are allowed to override how earlier ones
+    dump a type; that's how e.g. `PYTHON_TYPES` works.
+    """
+    def __init__(self, registries, version_locks):
+        self.representers = SafeDumper.yaml_representers.copy()
+        self.multi_representers = SafeDumper.yaml_multi_representers.copy()
+        # Always dump bytes as binary, even on Python 2
+        self.representers[bytes] = CamelDumper.represent_binary
+
+        self.tag_shorthands = {}
+        for registry, (prefix, shorthand) in registries.items():
+            if shorthand is None:
+                continue
+            if shorthand in self.tag_shorthands:
+                raise ValueError(
+                    "Conflicting tag shorthands: {!r} is short for both {!r} and {!r}"
+                    .format(shorthand, self.tag_shorthands[shorthand], prefix))
+            self.tag_shorthands[shorthand] = prefix
+
+        for registry in registries:
+            registry.inject_dumpers(self, version_locks=version_locks)
 
     def add_representer(self, data_type, representer):
-        self.yaml_representers[data_type] = representer
+        self.representers[data_type] = representer
 
     def add_multi_representer(self, data_type, representer):
-        self.yaml_multi_representers[data_type] = representer
+        self.multi_representers[data_type] = representer
+
+
+class Progress(object):
+    """Passed to the `progress` callback of `Camel.load_all`,
+    `Camel.load_all_file`, and `Camel.dump_all_file` after every document.
+
+    `documents` is the number of documents done so far.  `bytes` is how much
+    input has been read or output written, in bytes, counting text as utf8;
+    when loading, it runs ahead of the documents by up to one read buffer.
+    `document_bytes` and `document_time` are the change in bytes and the
+    seconds spent on the latest document, and `elapsed` is the time since
+    the first one started.  When loading, time spent by the consumer of the
+    documents isn't counted.
+
+    The callback runs between documents, so it can apply backpressure: to
+    pause or throttle the pipeline, just block (sleep, wait on an event, put
+    to a bounded queue).  To stop, call `cancel`, from the callback or any
+    other thread; loading then stops after handing over the current
+    document, and dumping closes the stream cleanly after it.
+    """
+    def __init__(self, callback, stream=None):
+        self.callback = callback
+        self.stream = stream
+        self.documents = 0
+        self.bytes = 0
+        self.document_bytes = 0
+        self.document_time = 0.0
+        self.elapsed = 0.0
+        self.cancelled = False
+        self.started = _clock()
+
+    def cancel(self):
+        self.cancelled = True
+
+    def document_done(self, started, total_bytes=None):
+        """Update the counts for a document that started at `started` (per
+        the same clock as `_clock`), and call the callback.
+        """
+        now = _clock()
+        if total_bytes is None:
+            total_bytes = self.stream.bytes
+        self.documents += 1
+        self.document_bytes = total_bytes - self.bytes
+        self.bytes = total_bytes
+        self.document_time = now - started
+        self.elapsed = now - self.started
+        self.callback(self)
+
+
+class _CountingStream(object):
+    """Wraps a file object, and counts the bytes read from or written to it,
+    with text counted as utf8.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.bytes = 0
 
+    def _count(self, data):
+        if isinstance(data, _str):
+            self.bytes += len(data.encode('utf8'))
+        else:
+            self.bytes += len(data)
 
-class CamelLoader(SafeLoader):
-    """Subclass of yaml's `SafeLoader` that scopes constructors to the
-    instance, rather than to the particular class, because damn.
-    """
-    def __init__(self, *args, **kwargs):
-        super(CamelLoader, self).__init__(*args, **kwargs)
-        self.yaml_constructors = SafeLoader.yaml_constructors.copy()
-        self.yaml_multi_constructors = SafeLoader.yaml_multi_constructors.copy()
-        self.yaml_implicit_resolvers = SafeLoader.yaml_implicit_resolvers.copy()
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self._count(data)
+        return data
 
-    def add_constructor(self, data_type, constructor):
-        self.yaml_constructors[data_type] = constructor
+    def write(self, data):
+        self._count(data)
+        return self.stream.write(data)
 
-    def add_multi_constructor(self, data_type, constructor):
-        self.yaml_multi_constructors[data_type] = constructor
+    def flush(self):
+        self.stream.flush()
 
-    def add_implicit_resolver(self, tag, regexp, first):
-        if first is None:
-            first = [None]
-        for ch in first:
-            self.yaml_implicit_resolvers.setdefault(ch, []).append((tag, regexp))
 
-    def add_path_resolver(self, *args, **kwargs):
-        # This API is non-trivial and claims to be experimental and unstable
-        raise NotImplementedError
+def _load_documents(loader, progress):
+    """Yield every document from `loader`, reporting to `progress` if it's
+    not None.
+    """
+    while True:
+        started = _clock()
+        if not loader.check_node():
+            return
+        data = loader.get_data()
+        if progress is not None:
+            progress.document_done(started)
+        yield data
+        if progress is not None and progress.cancelled:
+            return
 
 
 class Camel(object):
     """Class responsible for doing the actual dumping to and loading from YAML.
     """
-    def __init__(self, registries=()):
+    def __init__(
+            self, registries=(), implicit_types=True, string_hints=(),
+            max_bytes=None, max_nodes=None, max_depth=None,
+            max_alias_expansion=None, json_fast_path=False):
+        _load_backend()
         self.registries = collections.OrderedDict()
         self.version_locks = {}  # class => version
+        self.implicit_types = implicit_types
+        self.string_hints = frozenset(string_hints)
+        # Per-document limits; see CamelLoader
+        self.max_bytes = max_bytes
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_alias_expansion = max_alias_expansion
+        # Whether to try loading documents as JSON first; see _try_json
+        self.json_fast_path = json_fast_path
+
+        # Merged constructors and representers from every registry, along with
+        # what they were built from, so they can be rebuilt if the registries
+        # or version locks change
+        self._loader_index = None
+        self._loader_index_key = None
+        self._dumper_index = None
+        self._dumper_index_key = None
 
         self.add_registry(STANDARD_TYPES)
         for registry in registries:
             self.add_registry(registry)
 
     def add_registry(self, registry, tag_prefix=None, tag_shorthand=None):
+        previous = self.registries.get(registry)
         self.registries[registry] = (
             tag_prefix or registry.tag_prefix,
             tag_shorthand or registry.tag_shorthand,
         )
+        # Build the index now, so conflicts are caught here, and leave this
+        # Camel as it was if there are any
+        try:
+            self.get_loader_index()
+        except ValueError:
+            if previous is None:
+                del self.registries[registry]
+            else:
+                self.registries[registry] = previous
+            raise
 
     def lock_version(self, cls, version):
         self.version_locks[cls] = version
 
-    def make_dumper(self, stream):
-        tag_shorthands = {}
-        for registry, (prefix, shorthand) in self.registries.items():
-            if shorthand is None:
-                continue
-            if shorthand in tag_shorthands:
-                raise ValueError(
-                    "Conflicting tag shorthands: {!r} is short for both {!r} and {!r}"
-                    .format(shorthand, tag_shorthands[shorthand], prefix))
-            tag_shorthands[shorthand] = prefix
-
-        dumper = CamelDumper(stream, default_flow_style=False, tags=tag_shorthands)
-        for registry in self.registries:
-            registry.inject_dumpers(dumper, version_locks=self.version_locks)
-        return dumper
-
-    def dump(self, data):
+    def _registry_revisions(self):
+        return tuple(
+            (registry, registry.revision, settings)
+            for registry, settings in self.registries.items())
+
+    def get_loader_index(self):
+        """Return the merged constructors from all this Camel's registries,
+        building them if necessary.
+        """
+        key = self._registry_revisions()
+        if key != self._loader_index_key:
+            self._loader_index = _LoaderIndex(self.registries)
+            self._loader_index_key = key
+        return self._loader_index
+
+    def get_dumper_index(self, version_locks=None):
+        """Return the merged representers from all this Camel's registries,
+        building them if necessary.  Only the index for the Camel's own
+        version locks is kept around.
+        """
+        if version_locks is not None:
+            return _DumperIndex(self.registries, version_locks)
+
+        key = (self._registry_revisions(), frozenset(self.version_locks.items()))
+        if key != self._dumper_index_key:
+            self._dumper_index = _DumperIndex(self.registries, self.version_locks)
+            self._dumper_index_key = key
+        return self._dumper_index
+
+    def make_dumper(
+            self, stream, dedupe=False, dedupe_threshold=DEDUPE_THRESHOLD,
+            version_locks=None):
+        index = self.get_dumper_index(version_locks)
+        return CamelDumper(
+            stream, default_flow_style=False, tags=index.tag_shorthands,
+            dedupe=dedupe, dedupe_threshold=dedupe_threshold, index=index)
+
+    def dump(self, data, dedupe=False, dedupe_threshold=DEDUPE_THRESHOLD):
         stream = StringIO()
-        dumper = self.make_dumper(stream)
+        dumper = self.make_dumper(
+            stream, dedupe=dedupe, dedupe_threshold=dedupe_threshold)
         dumper.open()
         dumper.represent(data)
         dumper.close()
         return stream.getvalue()
 
-    def make_loader(self, stream):
-        loader = CamelLoader(stream)
-        for registry in self.registries:
-            registry.inject_loaders(loader)
+    def dump_all_file(
+            self, documents, file, compression='auto',
+            dedupe=False, dedupe_threshold=DEDUPE_THRESHOLD, progress=None):
+        """Dump an iterable of documents to `file`, which may be a path or a
+        binary file object.
+
+        `compression` may be `'gzip'`, `'bz2'`, `'lzma'`, or `None`.  The
+        default, `'auto'`, picks one from the file extension if given a path,
+        and doesn't compress otherwise.  Output is compressed as it's emitted,
+        so only the current document is ever held in memory.
+
+        If given, `progress` is called with a `Progress` after each document;
+        `bytes` counts the uncompressed output.
+        """
+        with _compressed_file(file, 'wb', compression) as fileobj:
+            text_stream = stream = io.TextIOWrapper(fileobj, encoding='utf8')
+            try:
+                if progress is not None:
+                    stream = _CountingStream(text_stream)
+                    progress = Progress(progress, stream)
+                dumper = self.make_dumper(
+                    stream, dedupe=dedupe, dedupe_threshold=dedupe_threshold)
+                dumper.open()
+                for document in documents:
+                    started = _clock()
+                    dumper.represent(document)
+                    if progress is not None:
+                        progress.document_done(started)
+                        if progress.cancelled:
+                            break
+                dumper.close()
+            finally:
+                # Otherwise the wrapper closes the file when it's collected
+                text_stream.flush()
+                text_stream.detach()
+
+    def dump_file(self, data, file, compression='auto', **kwargs):
+        """Dump a single document to `file`; see `dump_all_file`."""
+        self.dump_all_file([data], file, compression=compression, **kwargs)
+
+    def dump_versions(self, data, profiles):
+        """Dump the same data several times, with different version locks.
+
+        `profiles` is a mapping of names to version locks, in the same form as
+        `lock_version` takes them (``{cls: version}``); each profile is applied
+        on top of this Camel's own locks.  Returns an ordered mapping of the
+        same names to dumped YAML.
+
+        Any part of the data that only involves types dumped the same way by
+        every profile is only represented once, and shared by all the outputs.
+        """
+        shared = _SharedNodes()
+        streams = collections.OrderedDict()
+        dumpers = collections.OrderedDict()
+        for name, locks in profiles.items():
+            version_locks = dict(self.version_locks)
+            version_locks.update(locks)
+            streams[name] = StringIO()
+            dumpers[name] = self.make_dumper(
+                streams[name], version_locks=version_locks)
+            dumpers[name].shared_nodes = shared
+        shared.dumpers = list(dumpers.values())
+
+        results = collections.OrderedDict()
+        for name, dumper in dumpers.items():
+            dumper.open()
+            dumper.represent(data)
+            dumper.close()
+            results[name] = streams[name].getvalue()
+        return results
+
+    def make_loader(self, stream, intern=None, intern_limit=INTERN_LIMIT):
+        loader = CamelLoader(
+            stream,
+            implicit_types=self.implicit_types,
+            string_hints=self.string_hints,
+            intern=intern,
+            intern_limit=intern_limit,
+            index=self.get_loader_index(),
+            max_bytes=self.max_bytes,
+            max_nodes=self.max_nodes,
+            max_depth=self.max_depth,
+            max_alias_expansion=self.max_alias_expansion,
+        )
         return loader
 
-    def load(self, data):
+    def _try_json(self, data, intern):
+        """If the JSON fast path is enabled and applicable, load `data` with
+        the json module.  Raises `_NotJSON` if the document might not be JSON,
+        or if anything about this Camel would make the result differ from
+        loading it as YAML.
+        """
+        if not self.json_fast_path:
+            raise _NotJSON
+        # JSON has no tags, so only the builtin types are involved, and the
+        # only difference can come from settings that change those
+        if (not self.implicit_types
+                or intern == 'all'
+                or self.max_bytes is not None
+                or self.max_nodes is not None
+                or self.max_depth is not None
+                or self.max_alias_expansion is not None):
+            raise _NotJSON
+        constructors = self.get_loader_index().constructors
+        for tag in _JSON_TAGS:
+            if constructors.get(tag) is not SafeLoader.yaml_constructors.get(tag):
+                raise _NotJSON
+
+        # json already shares repeated keys, so intern='keys' comes for free.
+        # string_hints only apply to plain keys, and JSON keys are quoted
+        return _load_json(data)
+
+    def load(self, data, intern=None, intern_limit=INTERN_LIMIT):
+        try:
+            return self._try_json(data, intern)
+        except _NotJSON:
+            pass
+
         stream = StringIO(data)
-        loader = self.make_loader(stream)
+        loader = self.make_loader(
+            stream, intern=intern, intern_limit=intern_limit)
         obj = loader.get_data()
         if loader.check_node():
             raise RuntimeError("Multiple documents found in stream; use load_all")
         return obj
 
-    def load_first(self, data):
+    def load_first(self, data, intern=None, intern_limit=INTERN_LIMIT):
+        try:
+            return self._try_json(data, intern)
+        except _NotJSON:
+            pass
+
         stream = StringIO(data)
-        loader = self.make_loader(stream)
+        loader = self.make_loader(
+            stream, intern=intern, intern_limit=intern_limit)
         return loader.get_data()
 
-    def load_all(self, data):
+    def load_all(
+            self, data, intern=None, intern_limit=INTERN_LIMIT,
+            progress=None):
+        """Load every document in `data`, one at a time.
+
+        If given, `progress` is called with a `Progress` after each document.
+        """
+        started = _clock()
+        try:
+            obj = self._try_json(data, intern)
+        except _NotJSON:
+            pass
+        else:
+            if progress is not None:
+                Progress(progress).document_done(
+                    started, len(data.encode('utf8')))
+            yield obj
+            return
+
+        stream = StringIO(data)
+        if progress is not None:
+            stream = _CountingStream(stream)
+            progress = Progress(progress, stream)
+        loader = self.make_loader(
+            stream, intern=intern, intern_limit=intern_limit)
+        for obj in _load_documents(loader, progress):
+            yield obj
+
+    def load_all_file(
+            self, file, compression='auto',
+            intern=None, intern_limit=INTERN_LIMIT, progress=None):
+        """Load documents one at a time from `file`, which may be a path or a
+        binary file object.
+
+        `compression` may be `'gzip'`, `'bz2'`, `'lzma'`, or `None`.  The
+        default, `'auto'`, detects it from the first few bytes of the file.
+        The file is decompressed in chunks as the parser needs more input, so
+        memory use depends on the size of each document, not the whole file.
+
+        If given, `progress` is called with a `Progress` after each document;
+        `bytes` counts the decompressed input.
+        """
+        with _compressed_file(file, 'rb', compression) as fileobj:
+            if progress is not None:
+                fileobj = _CountingStream(fileobj)
+                progress = Progress(progress, fileobj)
+            loader = self.make_loader(
+                fileobj, intern=intern, intern_limit=intern_limit)
+            for obj in _load_documents(loader, progress):
+                yield obj
+
+    def load_frozen(self, data):
+        """Load a single document into a `FrozenDocument`: a compact,
+        read-only form that's cheap to share between forked processes.
+        """
         stream = StringIO(data)
         loader = self.make_loader(stream)
-        while loader.check_node():
-            yield loader.get_data()
+        node = loader.get_single_node()
+        if node is None:
+            node = yaml.ScalarNode(YAML_TAG_PREFIX + 'null', '')
+        return FrozenDocument(_freeze_node(loader, node), self)
+
+    def load_file(self, file, compression='auto', **kwargs):
+        """Load a single document from `file`; see `load_all_file`."""
+        with _compressed_file(file, 'rb', compression) as fileobj:
+            loader = self.make_loader(fileobj, **kwargs)
+            obj = loader.get_data()
+            if loader.check_node():
+                raise RuntimeError("Multiple documents found in stream; use load_all_file")
+            return obj
+
+    def _patch_replacement(self, loader, path, value):
+        """Find the node at `path` and dump `value` to replace it.  Returns
+        the range of characters to replace, and the text to put there.
+        """
+        start, end, first, key_event = _find_patch_span(loader, path)
+
+        # Dump as an item in a flow sequence, so the result is flow style all
+        # the way down and fits wherever the old value was.  Tags are written
+        # out in full, since the document may not have the same %TAG
+        # directives
+        stream = StringIO()
+        dumper = CamelDumper(
+            stream, default_flow_style=True, width=_PATCH_WIDTH,
+            index=self.get_dumper_index())
+        dumper.open()
+        dumper.represent([value])
+        dumper.close()
+        fragment = stream.getvalue().rstrip('\n')[1:-1]
+
+        # A block collection (or an empty value) may start on the line after
+        # its key, at the key's own indentation, where a flow value isn't
+        # allowed; so for those, replace from the end of the key instead
+        is_block = (
+            isinstance(first, yaml.CollectionStartEvent)
+            and not first.flow_style)
+        if key_event is not None and (is_block or end == start):
+            indent = key_event.start_mark.column + 1
+            fragment = ': ' + _indent_fragment(fragment, indent)
+            return key_event.end_mark.index, end, fragment
+
+        fragment = _indent_fragment(fragment, first.start_mark.column)
+        if end == start:
+            fragment = ' ' + fragment
+        return start, end, fragment
+
+    def patch(self, data, path, value):
+        """Replace the value at `path` in the YAML text `data` with `value`,
+        and return the new text.
+
+        `path` is a sequence of mapping keys and sequence indices; an empty
+        path replaces the whole (first) document.  Only `value` is dumped,
+        in flow style, and the rest of the text is left exactly as it was,
+        comments and all.  Nothing past the target is parsed, and nothing but
+        the keys along the way is constructed.
+
+        Raises `KeyError` or `IndexError` if the path doesn't exist, and
+        `ValueError` if it goes through an alias or the old value contains
+        an anchor, since the result wouldn't mean the same thing.
+        """
+        loader = self.make_loader(StringIO(data))
+        start, end, fragment = self._patch_replacement(loader, path, value)
+        return (
+            data[:start] + fragment + _trailing_whitespace(data[start:end])
+            + data[end:])
+
+    def patch_file(self, filename, path, value):
+        """Replace the value at `path` in the YAML file `filename` with
+        `value`; see `patch`.
+
+        The file is parsed only as far as the target, and the rest is copied
+        in chunks to a temporary file that then replaces the original, so
+        readers never see a half-written file.  Compressed files aren't
+        supported.
+        """
+        import shutil
+        import tempfile
+
+        with io.open(filename, 'r', encoding='utf8', newline='') as source:
+            loader = self.make_loader(source)
+            start, end, fragment = self._patch_replacement(loader, path, value)
+            source.seek(0)
+
+            fd, temp_filename = tempfile.mkstemp(
+                dir=os.path.dirname(os.path.abspath(filename)),
+                prefix='.camel-patch-')
+            try:
+                with io.open(fd, 'w', encoding='utf8', newline='') as dest:
+                    _copy_chars(source, dest, start)
+                    dest.write(fragment)
+                    dest.write(_copy_chars(source, None, end - start))
+                    shutil.copyfileobj(source, dest)
+                shutil.copymode(filename, temp_filename)
+                _replace_file(temp_filename, filename)
+            except BaseException:
+                os.remove(temp_filename)
+                raise
+
+    def incremental_dumper(self, get_version=None):
+        """Return an `IncrementalDumper` for dumping the same data repeatedly.
+        """
+        return IncrementalDumper(self, get_version=get_version)
+
+
+# -----------------------------------------------------------------------------
+# Incremental dumping
+#
+# The emitter is a deterministic state machine, and a block collection always
+# starts right after a ':' or '-' and is always followed by a fresh line.  So
+# the text of a block collection depends only on the collection itself and on
+# where it starts: which indicator, and at what indentation.  That text can be
+# cached, and on later dumps the collection can be represented by a short
+# placeholder scalar instead, then swapped for the cached text afterwards.
+
+class _CantReuse(Exception):
+    pass
+
+
+class _Fragment(object):
+    """What an `IncrementalDumper` remembers about one versioned object."""
+    def __init__(self, data, version):
+        self.data = data
+        self.version = version
+        # Fragments for versioned objects anywhere inside this one
+        self.inner = []
+        # ids of every aliasable object inside, including this one
+        self.ids = set()
+        # (indicator, indent) => emitted text; None if this object turned up
+        # somewhere its text can't be reused
+        self.texts = {}
+
+    def is_current(self, version, get_version):
+        if version != self.version:
+            return False
+        for fragment in self.inner:
+            if get_version(fragment.data) != fragment.version:
+                return False
+        return True
+
+
+def _camel_version(data):
+    return getattr(data, 'camel_version', None)
+
+
+# Longest key that the emitter is guaranteed to write as a simple `key: value`
+_SIMPLE_KEY_LENGTH = 100
+_line_break_rx = _LazyRegex('[\n\x85\u2028\u2029]')
+
+
+class IncrementalDumper(object):
+    """Dumps the same, mostly unchanging, data over and over, reusing the
+    text of anything that hasn't changed since the last dump.  The output is
+    always exactly what `Camel.dump` would produce.
+
+    Objects opt in by having a `camel_version` attribute (or whatever
+    `get_version` returns for them, if given) that changes whenever the
+    object, or anything inside it, changes.  Versioned objects inside other
+    versioned objects are checked too, so a counter that only covers the
+    object's own attributes is fine.  Anything with a version of None is
+    always dumped from scratch.
+
+    Only objects dumped as block collections are cached.  If a cached object
+    turns up somewhere its text can't be reused (say, inside a flow
+    collection), or is shared with another part of the data so it'd need an
+    anchor, the whole document is dumped normally instead.
+    """
+    def __init__(self, camel, get_version=None):
+        import re
+        import uuid
+
+        self.camel = camel
+        self.get_version = get_version or _camel_version
+        self.fragments = {}  # id(data) => _Fragment
+        self.index = None
+        self.token = 'camel-fragment-{0}-'.format(uuid.uuid4().hex)
+        self.token_rx = re.compile(' ' + re.escape(self.token) + '([0-9]+)')
+
+    def dump(self, data):
+        """Dump `data` to a string, like `Camel.dump`."""
+        index = self.camel.get_dumper_index()
+        if index is not self.index:
+            self.fragments = {}
+            self.index = index
+
+        try:
+            return self._dump(data)
+        except _CantReuse:
+            return self.camel.dump(data)
+        finally:
+            self.stack = self.used = self.placeholders = None
+
+    def _dump(self, data):
+        # Represent, with placeholders for anything cached
+        self.stack = []
+        self.used = []
+        self.placeholders = []  # placeholder number => (node, fragment)
+        new_fragments = {}  # id(node) => _Fragment
+        self.new_fragments = new_fragments
+        stream = StringIO()
+        dumper = self.camel.make_dumper(stream)
+        dumper.fragments = self
+        try:
+            root = dumper.represent_data(data)
+        finally:
+            dumper.fragments = None
+            self.new_fragments = None
+
+        # Anything that appears twice needs an anchor, which a cached
+        # fragment won't have
+        ids = set(dumper.represented_objects)
+        expected = len(ids)
+        placeholder_ids = {}
+        for number, (node, fragment) in enumerate(self.placeholders):
+            ids.update(fragment.ids)
+            expected += len(fragment.ids)
+            placeholder_ids[id(node)] = number
+        if len(ids) != expected:
+            raise _CantReuse
+
+        if id(root) in placeholder_ids:
+            fragment = self.placeholders[0][1]
+            text = fragment.texts.get(('root', 0))
+            if text is None:
+                raise _CantReuse
+            self._keep_used()
+            return text
+
+        # Work out where every collection will be emitted, then fill in the
+        # text for every placeholder, and emit and cache every new versioned
+        # collection, innermost first
+        order = []
+        self._walk(root, ('root', 0), None, None, set(), order,
+                   placeholder_ids, new_fragments)
+        texts = {}
+        for node, context, parent, slot in order:
+            if id(node) in placeholder_ids:
+                number = placeholder_ids[id(node)]
+                fragment = self.placeholders[number][1]
+                if context not in fragment.texts:
+                    fresh = self.camel.make_dumper(StringIO()).represent_data(
+                        fragment.data)
+                    fragment.texts[context] = self._emit_in_context(
+                        fresh, context)
+                texts[number] = fragment.texts[context]
+            else:
+                fragment = new_fragments[id(node)]
+                text = self._emit_in_context(node, context)
+                if text is None:
+                    fragment.texts = None
+                    continue
+                fragment.texts[context] = text = self._fill(text, texts)
+                placeholder = self._placeholder(fragment)
+                texts[len(self.placeholders) - 1] = text
+                if isinstance(parent, yaml.MappingNode):
+                    parent.value[slot] = (parent.value[slot][0], placeholder)
+                else:
+                    parent.value[slot] = placeholder
+
+        dumper.open()
+        dumper.serialize(root)
+        dumper.close()
+        text = self._fill(stream.getvalue(), texts)
+        if id(root) in new_fragments:
+            new_fragments[id(root)].texts[('root', 0)] = text
+        self._keep_used()
+        return text
+
+    def _keep_used(self):
+        self.fragments = dict(
+            (id(fragment.data), fragment) for fragment in self.used)
+
+    def _placeholder(self, fragment):
+        node = yaml.ScalarNode(
+            _STR_TAG, self.token + _str(len(self.placeholders)))
+        self.placeholders.append((node, fragment))
+        return node
+
+    def represent_data(self, dumper, data):
+        if dumper.ignore_aliases(data):
+            return SafeDumper.represent_data(dumper, data)
+
+        version = self.get_version(data)
+        if version is None:
+            node = SafeDumper.represent_data(dumper, data)
+            if self.stack:
+                self.stack[-1].ids.add(id(data))
+            return node
+
+        fragment = self.fragments.get(id(data))
+        if (fragment is not None
+                and fragment.data is data
+                and fragment.texts is not None
+                and fragment.is_current(version, self.get_version)):
+            node = self._placeholder(fragment)
+            self.used.extend(fragment.inner)
+        else:
+            fragment = _Fragment(data, version)
+            self.stack.append(fragment)
+            try:
+                node = SafeDumper.represent_data(dumper, data)
+            finally:
+                self.stack.pop()
+            fragment.ids.add(id(data))
+            self.new_fragments[id(node)] = fragment
+
+        self.used.append(fragment)
+        if self.stack:
+            parent = self.stack[-1]
+            parent.ids.update(fragment.ids)
+            parent.inner.append(fragment)
+            parent.inner.extend(fragment.inner)
+        return node
+
+    def _walk(self, node, context, parent, slot, seen, order,
+              placeholder_ids, new_fragments):
+        """Find the emitting context of every placeholder and new versioned
+        collection under `node`, appending them to `order` children first.
+        `context` is where `node` starts: after a ':' at some indentation,
+        after a '-' at some indentation, or at the start of the document.
+        None means somewhere cached text can't go.
+        """
+        if id(node) in seen:
+            raise _CantReuse
+        seen.add(id(node))
+
+        is_block = (
+            not isinstance(node, yaml.ScalarNode)
+            and not node.flow_style and node.value)
+        child_indent = None
+        if context is not None and is_block:
+            indicator, indent = context
+            if indicator == 'root':
+                child_indent = 0
+            elif (isinstance(node, yaml.SequenceNode)
+                    and indicator == 'value'):
+                # Sequences in mappings aren't indented
+                child_indent = indent
+            else:
+                child_indent = indent + 2
+
+        if isinstance(node, yaml.MappingNode):
+            for i, (key, value) in enumerate(node.value):
+                self._walk(key, None, None, None, seen, order,
+                           placeholder_ids, new_fragments)
+                value_context = None
+                if (child_indent is not None
+                        and isinstance(key, yaml.ScalarNode)
+                        and len(key.value) + len(key.tag) < _SIMPLE_KEY_LENGTH
+                        and not _line_break_rx.search(key.value)):
+                    value_context = ('value', child_indent)
+                self._walk(value, value_context, node, i, seen, order,
+                           placeholder_ids, new_fragments)
+        elif isinstance(node, yaml.SequenceNode):
+            for i, item in enumerate(node.value):
+                item_context = None
+                if child_indent is not None:
+                    item_context = ('item', child_indent)
+                self._walk(item, item_context, node, i, seen, order,
+                           placeholder_ids, new_fragments)
+
+        if id(node) in placeholder_ids:
+            if context is None:
+                # Don't try to reuse it next time, either
+                self.placeholders[placeholder_ids[id(node)]][1].texts = None
+                raise _CantReuse
+            order.append((node, context, parent, slot))
+        elif id(node) in new_fragments and context != ('root', 0):
+            if context is None or not is_block:
+                new_fragments[id(node)].texts = None
+            else:
+                order.append((node, context, parent, slot))
+
+    def _emit_in_context(self, node, context):
+        """Emit `node` as if it were at `context`, by wrapping it in dummy
+        collections that put it there.  Returns the text emitted after the
+        ':' or '-', or None if it can't be reused.
+        """
+        indicator, indent = context
+        if indent % 2:
+            return None
+        mark = self.token.rstrip('-')
+        if indicator == 'value':
+            wrapper = yaml.MappingNode(_MAP_TAG, [
+                (yaml.ScalarNode(_STR_TAG, mark), node),
+            ], flow_style=False)
+            start = mark + ':'
+        else:
+            wrapper = yaml.MappingNode(_MAP_TAG, [
+                (yaml.ScalarNode(_STR_TAG, mark), yaml.SequenceNode(_SEQ_TAG, [
+                    yaml.ScalarNode(_STR_TAG, mark), node,
+                ], flow_style=False)),
+            ], flow_style=False)
+            start = mark + '\n' + ' ' * indent + '-'
+        for _ in range(indent // 2):
+            wrapper = yaml.MappingNode(_MAP_TAG, [
+                (yaml.ScalarNode(_STR_TAG, mark), wrapper),
+            ], flow_style=False)
+
+        stream = StringIO()
+        dumper = self.camel.make_dumper(stream)
+        dumper.open()
+        dumper.serialize(wrapper)
+        dumper.close()
+        text = stream.getvalue()
+
+        # The document ends with a line break, unless the collection already
+        # ended with one, which then doubles as the break before whatever
+        # comes next; either way, exactly one belongs to what follows.  An
+        # explicit document end means the emitter was left in a state that
+        # might affect what follows
+        position = text.rfind(start)
+        if (position < 0 or not text.endswith('\n')
+                or text.endswith('\n...\n')):
+            return None
+        return text[position + len(start):-1]
+
+    def _fill(self, text, texts):
+        try:
+            text = self.token_rx.sub(
+                lambda match: texts[int(match.group(1))], text)
+        except KeyError:
+            raise _CantReuse
+        if self.token in text:
+            raise _CantReuse
+        return text
+
+
+# -----------------------------------------------------------------------------
+# Frozen documents
+#
+# A whole document packed into a single flat buffer, and read through
+# lightweight views.  Meant for pre-fork servers: load once in the parent,
+# and children can read as much as they like without writing to (and thus
+# copying) the pages the data lives in, since there are no per-value Python
+# objects to have their refcounts bumped.
+#
+# Layout, all little-endian:
+#   header:   b'CAMEL\x01', root offset (Q), tag table offset (Q)
+#   scalar:   b'S', tag (I), length (I), utf8 value
+#   sequence: b'Q', tag (I), count (I), count child offsets (Q)
+#   mapping:  b'M', tag (I), count (I), sorted flag (B),
+#             count key and value offsets (QQ), then if sorted, count entry
+#             indices (I) ordered by the keys' utf8
+#   tags:     count (I), then each tag as length (I) and utf8
+# The sorted flag is set when every key is a string, so lookups can do a
+# binary search.  Nodes that appear more than once, via aliases, are only
+# stored once.
+
+_FROZEN_MAGIC = b'CAMEL\x01'
+_frozen_header = struct.Struct('<6sQQ')
+_frozen_node = struct.Struct('<cII')
+_frozen_offset = struct.Struct('<Q')
+_frozen_pair = struct.Struct('<QQ')
+_frozen_index = struct.Struct('<I')
+_frozen_flag = struct.Struct('<B')
+
+_STR_TAG = YAML_TAG_PREFIX + 'str'
+_SEQ_TAG = YAML_TAG_PREFIX + 'seq'
+_MAP_TAG = YAML_TAG_PREFIX + 'map'
+# Scalars that are cheap enough to construct every time they're read
+_SIMPLE_SCALAR_TAGS = frozenset(
+    YAML_TAG_PREFIX + name for name in ('null', 'bool', 'int', 'float'))
+
+
+def _freeze_node(loader, root):
+    """Pack a composed node graph into a frozen document buffer."""
+    buf = bytearray(_frozen_header.size)
+    tags = {}  # tag => index
+    offsets = {}  # id(node) => offset
+
+    def tag_index(tag):
+        return tags.setdefault(tag, len(tags))
+
+    def freeze(node):
+        if id(node) in offsets:
+            return offsets[id(node)]
+        offset = offsets[id(node)] = len(buf)
+
+        if isinstance(node, yaml.ScalarNode):
+            value = node.value.encode('utf8')
+            buf.extend(_frozen_node.pack(b'S', tag_index(node.tag), len(value)))
+            buf.extend(value)
+            return offset
+
+        if isinstance(node, yaml.SequenceNode):
+            buf.extend(_frozen_node.pack(
+                b'Q', tag_index(node.tag), len(node.value)))
+            # Reserve room for the children's offsets, and fill it in after,
+            # so that recursive structures still work
+            start = len(buf)
+            buf.extend(bytearray(_frozen_offset.size * len(node.value)))
+            for i, child in enumerate(node.value):
+                _frozen_offset.pack_into(
+                    buf, start + i * _frozen_offset.size, freeze(child))
+            return offset
+
+        # Mapping; let pyyaml deal with << merge keys first, the same way it
+        # would when constructing a dict
+        if node.tag == _MAP_TAG:
+            loader.flatten_mapping(node)
+        # Later duplicate keys win, as in a dict.  Only scalar keys can be
+        # compared here, but those are the only ones that'd work in a dict.
+        # Anything but a string is compared as constructed, since 1 and 0x1,
+        # or ~ and null, are the same key
+        deduped = collections.OrderedDict()
+        for key, value in node.value:
+            if not isinstance(key, yaml.ScalarNode):
+                dedupe_key = key
+            elif key.tag == _STR_TAG:
+                dedupe_key = key.value
+            else:
+                try:
+                    dedupe_key = loader.construct_object(key)
+                    hash(dedupe_key)
+                except (yaml.YAMLError, TypeError, ValueError):
+                    dedupe_key = (key.tag, key.value)
+            if dedupe_key in deduped:
+                deduped[dedupe_key] = (deduped[dedupe_key][0], value)
+            else:
+                deduped[dedupe_key] = (key, value)
+        pairs = list(deduped.values())
+        all_strings = all(
+            isinstance(key, yaml.ScalarNode) and key.tag == _STR_TAG
+            for key, _ in pairs)
+
+        buf.extend(_frozen_node.pack(b'M', tag_index(node.tag), len(pairs)))
+        buf.extend(_frozen_flag.pack(all_strings))
+        start = len(buf)
+        buf.extend(bytearray(_frozen_pair.size * len(pairs)))
+        if all_strings:
+            order = sorted(
+                range(len(pairs)),
+                key=lambda i: pairs[i][0].value.encode('utf8'))
+            for i in order:
+                buf.extend(_frozen_index.pack(i))
+        for i, (key, value) in enumerate(pairs):
+            _frozen_pair.pack_into(
+                buf, start + i * _frozen_pair.size, freeze(key), freeze(value))
+        return offset
+
+    root_offset = freeze(root)
+
+    tag_offset = len(buf)
+    buf.extend(_frozen_index.pack(len(tags)))
+    for tag in sorted(tags, key=tags.get):
+        encoded = tag.encode('utf8')
+        buf.extend(_frozen_index.pack(len(encoded)))
+        buf.extend(encoded)
+
+    _frozen_header.pack_into(buf, 0, _FROZEN_MAGIC, root_offset, tag_offset)
+    return bytes(buf)
+
+
+class FrozenDocument(object):
+    """A read-only document packed into a single buffer, from
+    `Camel.load_frozen`.
+
+    `root` is the top-level value.  Mappings and sequences come out as
+    `FrozenMapping` and `FrozenSequence` views, and strings, numbers, and so
+    on are decoded each time they're read.  Anything with a tag of its own
+    (including the ones from a Camel's registries) is constructed by the
+    Camel the first time it's read, and then cached.
+
+    `buffer` may be anything supporting the buffer protocol, such as `bytes`
+    or a `multiprocessing.shared_memory.SharedMemory`'s `buf`.
+    """
+    def __init__(self, buffer, camel):
+        self.buffer = memoryview(buffer)
+        self.camel = camel
+        magic, self._root_offset, tag_offset = _frozen_header.unpack_from(
+            self.buffer, 0)
+        if magic != _FROZEN_MAGIC:
+            raise ValueError("Not a frozen Camel document")
+
+        count, = _frozen_index.unpack_from(self.buffer, tag_offset)
+        pos = tag_offset + _frozen_index.size
+        self.tags = []
+        for _ in range(count):
+            length, = _frozen_index.unpack_from(self.buffer, pos)
+            pos += _frozen_index.size
+            self.tags.append(self.buffer[pos:pos + length].tobytes().decode('utf8'))
+            pos += length
+
+        self._loader = None
+        # offset => constructed object, for tagged values
+        self._constructed = {}
+
+    @property
+    def root(self):
+        return self._value_at(self._root_offset)
+
+    @property
+    def loader(self):
+        if self._loader is None:
+            self._loader = self.camel.make_loader(StringIO(''))
+        return self._loader
+
+    def share(self, name=None):
+        """Copy the buffer into a new `SharedMemory` block, which other
+        processes can `attach` to by name.  The caller is responsible for
+        eventually closing and unlinking it.
+        """
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(
+            name=name, create=True, size=len(self.buffer))
+        shm.buf[:len(self.buffer)] = self.buffer
+        return shm
+
+    @classmethod
+    def attach(cls, name, camel):
+        """Open a document that another process `share`d.  Returns the
+        document and the `SharedMemory`.  When done, `close` the document
+        first, then the `SharedMemory`.
+        """
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(name=name)
+        return cls(shm.buf, camel), shm
+
+    def close(self):
+        """Let go of the buffer.  Any views into the document stop working."""
+        self.buffer.release()
+
+    # Decoding
+
+    def _scalar_value(self, offset):
+        _, _, length = _frozen_node.unpack_from(self.buffer, offset)
+        start = offset + _frozen_node.size
+        return self.buffer[start:start + length].tobytes().decode('utf8')
+
+    def _value_at(self, offset):
+        kind, tag_index, _ = _frozen_node.unpack_from(self.buffer, offset)
+        tag = self.tags[tag_index]
+        if kind == b'S':
+            if tag == _STR_TAG:
+                return self._scalar_value(offset)
+            if tag in _SIMPLE_SCALAR_TAGS:
+                node = yaml.ScalarNode(tag, self._scalar_value(offset))
+                return self.loader.yaml_constructors[tag](self.loader, node)
+        elif kind == b'Q' and tag == _SEQ_TAG:
+            return FrozenSequence(self, offset)
+        elif kind == b'M' and tag == _MAP_TAG:
+            return FrozenMapping(self, offset)
+
+        try:
+            return self._constructed[offset]
+        except KeyError:
+            pass
+        value = self._constructed[offset] = self.loader.construct_document(
+            self._node_at(offset, {}))
+        return value
+
+    def _node_at(self, offset, nodes):
+        """Rebuild a real yaml node graph, to hand to a constructor."""
+        if offset in nodes:
+            return nodes[offset]
+        kind, tag_index, count = _frozen_node.unpack_from(self.buffer, offset)
+        tag = self.tags[tag_index]
+        pos = offset + _frozen_node.size
+
+        if kind == b'S':
+            node = nodes[offset] = yaml.ScalarNode(tag, self._scalar_value(offset))
+        elif kind == b'Q':
+            node = nodes[offset] = yaml.SequenceNode(tag, [])
+            for i in range(count):
+                child, = _frozen_offset.unpack_from(
+                    self.buffer, pos + i * _frozen_offset.size)
+                node.value.append(self._node_at(child, nodes))
+        else:
+            node = nodes[offset] = yaml.MappingNode(tag, [])
+            pos += _frozen_flag.size
+            for i in range(count):
+                key, value = _frozen_pair.unpack_from(
+                    self.buffer, pos + i * _frozen_pair.size)
+                node.value.append(
+                    (self._node_at(key, nodes), self._node_at(value, nodes)))
+        return node
+
+
+class FrozenSequence(Sequence):
+    """Read-only view of a sequence in a `FrozenDocument`."""
+    __slots__ = ('_document', '_offset', '_count')
+
+    def __init__(self, document, offset):
+        self._document = document
+        self._offset = offset
+        _, _, self._count = _frozen_node.unpack_from(document.buffer, offset)
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        child, = _frozen_offset.unpack_from(
+            self._document.buffer,
+            self._offset + _frozen_node.size + index * _frozen_offset.size)
+        return self._document._value_at(child)
+
+    def __eq__(self, other):
+        if not isinstance(other, (Sequence, list)) or isinstance(other, (_str, _bytes)):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a == b for a, b in zip(self, other))
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "<FrozenSequence {0!r}>".format(list(self))
+
+
+class FrozenMapping(Mapping):
+    """Read-only view of a mapping in a `FrozenDocument`."""
+    __slots__ = ('_document', '_offset', '_count', '_sorted')
+
+    def __init__(self, document, offset):
+        self._document = document
+        self._offset = offset
+        _, _, self._count = _frozen_node.unpack_from(document.buffer, offset)
+        self._sorted, = _frozen_flag.unpack_from(
+            document.buffer, offset + _frozen_node.size)
+
+    def _pair(self, index):
+        return _frozen_pair.unpack_from(
+            self._document.buffer,
+            self._offset + _frozen_node.size + _frozen_flag.size
+            + index * _frozen_pair.size)
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        for i in range(self._count):
+            key, _ = self._pair(i)
+            yield self._document._value_at(key)
+
+    def __getitem__(self, key):
+        document = self._document
+        if self._sorted:
+            if not isinstance(key, _str):
+                raise KeyError(key)
+            # Binary search over the keys' utf8, which sorts the same way as
+            # the keys themselves
+            target = key.encode('utf8')
+            buffer = document.buffer
+            index_start = (
+                self._offset + _frozen_node.size + _frozen_flag.size
+                + self._count * _frozen_pair.size)
+            lo, hi = 0, self._count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                i, = _frozen_index.unpack_from(
+                    buffer, index_start + mid * _frozen_index.size)
+                key_offset, value_offset = self._pair(i)
+                _, _, length = _frozen_node.unpack_from(buffer, key_offset)
+                start = key_offset + _frozen_node.size
+                candidate = buffer[start:start + length].tobytes()
+                if candidate < target:
+                    lo = mid + 1
+                elif candidate > target:
+                    hi = mid
+                else:
+                    return document._value_at(value_offset)
+            raise KeyError(key)
+
+        for i in range(self._count):
+            key_offset, value_offset = self._pair(i)
+            if document._value_at(key_offset) == key:
+                return document._value_at(value_offset)
+        raise KeyError(key)
+
+    def __repr__(self):
+        return "<FrozenMapping {0!r}>".format(dict(self.items()))
+
+
+# -----------------------------------------------------------------------------
+# Config store
+#
+# Keeps a set of files loaded, and reloads them when they change on disk.
+# Changes are spotted by polling os.stat, which needs nothing outside the
+# stdlib and works everywhere, at the cost of noticing changes up to one
+# interval late.
+
+def _file_signature(filename):
+    stat = os.stat(filename)
+    # Inode too, so atomically replacing the file is noticed even if the
+    # size and mtime happen to match
+    mtime = getattr(stat, 'st_mtime_ns', stat.st_mtime)
+    return (mtime, stat.st_size, stat.st_ino)
+
+
+class ConfigStore(object):
+    """Loads YAML files with a `Camel`, and keeps them up to date.
+
+    `get` returns the loaded data for a file, loading it the first time.
+    After that it's a dict lookup: reloading happens separately, either by
+    calling `check` or by `start`ing a background thread that calls it
+    every `interval` seconds.  Only files whose mtime, size, or inode have
+    changed are reloaded, and each new value is swapped in all at once, so
+    readers see either the old data or the new, never a mix.
+
+    `subscribe` registers a callback that's called as
+    ``callback(filename, old, new)`` after a file is reloaded.  If a file
+    fails to load (or disappears), the old data is kept and `on_error` is
+    called as ``on_error(filename, exception)``; by default errors are
+    ignored, though the latest one for each file is kept in `errors`.
+    Exceptions raised by callbacks are handled the same way.  Neither is
+    called with the store locked, so both may use it.
+    """
+    def __init__(self, camel, interval=1.0, on_error=None):
+        import threading
+
+        self.camel = camel
+        self.interval = interval
+        self.on_error = on_error
+        # filename => loaded data; replaced wholesale, never modified, so
+        # reads don't need the lock
+        self.values = {}
+        self.signatures = {}
+        self.errors = {}
+        self.callbacks = []
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stopping = threading.Event()
+
+    def __contains__(self, filename):
+        return filename in self.values
+
+    def get(self, filename):
+        """Return the data loaded from `filename`, loading it and watching it
+        for changes if it isn't already.
+        """
+        try:
+            return self.values[filename]
+        except KeyError:
+            pass
+
+        # Load without the lock, so a slow file doesn't hold up the others
+        signature = _file_signature(filename)
+        data = self.camel.load_file(filename)
+        with self.lock:
+            # Another thread may have got there first
+            if filename not in self.values:
+                self._swap(filename, data, signature)
+            return self.values[filename]
+
+    def snapshot(self):
+        """Return a read-only mapping of every watched file to its current
+        data, all from the same moment.
+        """
+        # values is replaced rather than modified, so a view of it never
+        # changes; Python 2 has no MappingProxyType, so copy it there
+        return getattr(types, 'MappingProxyType', dict)(self.values)
+
+    def forget(self, filename):
+        """Stop watching `filename`."""
+        with self.lock:
+            values = dict(self.values)
+            values.pop(filename, None)
+            self.values = values
+            self.signatures.pop(filename, None)
+            self.errors.pop(filename, None)
+
+    def subscribe(self, callback):
+        """Call ``callback(filename, old, new)`` whenever a file is reloaded.
+        Returns `callback`, so this works as a decorator.
+        """
+        self.callbacks.append(callback)
+        return callback
+
+    def unsubscribe(self, callback):
+        self.callbacks.remove(callback)
+
+    def _swap(self, filename, data, signature):
+        values = dict(self.values)
+        values[filename] = data
+        self.values = values
+        self.signatures[filename] = signature
+
+    def check(self):
+        """Reload any watched files that have changed.  Returns a list of the
+        files that were reloaded.
+        """
+        with self.lock:
+            signatures = dict(self.signatures)
+
+        # The lock is only held to swap in new data, so callbacks and
+        # on_error can call get() or forget(), and slow loads don't block
+        changes = []
+        for filename, known in signatures.items():
+            try:
+                signature = _file_signature(filename)
+                if signature == known:
+                    continue
+                data = self.camel.load_file(filename)
+            except Exception as e:
+                self._report(filename, e)
+                continue
+
+            with self.lock:
+                # Skip files forgotten or reloaded by someone else meanwhile
+                if self.signatures.get(filename) != known:
+                    continue
+                self.errors.pop(filename, None)
+                old = self.values[filename]
+                self._swap(filename, data, signature)
+            changes.append((filename, old, data))
+
+        for filename, old, new in changes:
+            for callback in list(self.callbacks):
+                try:
+                    callback(filename, old, new)
+                except Exception as e:
+                    self._report(filename, e)
+        return [filename for filename, _, _ in changes]
+
+    def _report(self, filename, exception):
+        with self.lock:
+            if filename in self.signatures:
+                self.errors[filename] = exception
+        if self.on_error is not None:
+            self.on_error(filename, exception)
+
+    def start(self):
+        """Start checking for changes in a background thread."""
+        import threading
+
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self._run, name='ConfigStore')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """Stop the background thread, waiting for it to finish."""
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self.thread = None
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            self.check()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
 
 
 class DuplicateVersion(ValueError):
@@ -183,6 +1849,8 @@ class CamelRegistry(object):
     def __init__(self, tag_prefix='!', tag_shorthand=None):
         self.tag_prefix = tag_prefix
         self.tag_shorthand = tag_shorthand
+        # Bumped whenever something is added, so a Camel knows to rebuild
+        self.revision = 0
 
         # type => {version => function)
         self.dumpers = collections.defaultdict(dict)
@@ -204,7 +1872,13 @@ class CamelRegistry(object):
             raise ValueError(
                 "Tags may not contain semicolons: {0!r}".format(tag))
 
-    def dumper(self, cls, tag, version, inherit=False):
+    def dumper(self, cls, tag, version, inherit=False, raw=False):
+        """Register a function that dumps `cls` as `tag`.
+
+        Normally the function takes the object and returns a native YAML type.
+        With `raw=True`, it takes the dumper, the object, and the full tag, and
+        returns a yaml node directly, skipping the intermediate value.
+        """
         self._check_tag(tag)
 
         if inherit:
@@ -226,9 +1900,14 @@ class CamelRegistry(object):
                 "Expected None or a positive integer version; "
                 "got {0!r} instead".format(version))
 
+        if raw:
+            run = self.run_raw_representer
+        else:
+            run = self.run_representer
+
         def decorator(f):
-            store_in[cls][version] = functools.partial(
-                self.run_representer, f, full_tag)
+            store_in[cls][version] = functools.partial(run, f, full_tag)
+            self.revision += 1
             return f
 
         return decorator
@@ -260,6 +1939,9 @@ class CamelRegistry(object):
                 "for {!r} returned {!r}, which is of type {!r}"
                 .format(data, canon_value, canon_type))
 
+    def run_raw_representer(self, representer, tag, dumper, data):
+        return representer(dumper, data, tag)
+
     def inject_dumpers(self, dumper, version_locks=None):
         if not version_locks:
             version_locks = {}
@@ -286,7 +1968,13 @@ class CamelRegistry(object):
     # Loading
     # TODO implement "upgrader", which upgrades from one version to another
 
-    def loader(self, tag, version):
+    def loader(self, tag, version, raw=False):
+        """Register a function that loads `tag`.
+
+        Normally the function takes the already-constructed native value and
+        the version.  With `raw=True`, it takes the loader, the yaml node, and
+        the version, and is responsible for constructing the node itself.
+        """
         self._check_tag(tag)
 
         if version in self.loaders[tag]:
@@ -294,9 +1982,14 @@ class CamelRegistry(object):
 
         tag = self.tag_prefix + tag
 
+        if raw:
+            run = self.run_raw_constructor
+        else:
+            run = self.run_constructor
+
         def decorator(f):
-            self.loaders[tag][version] = functools.partial(
-                self.run_constructor, f, version)
+            self.loaders[tag][version] = functools.partial(run, f, version)
+            self.revision += 1
             return f
 
         return decorator
@@ -319,6 +2012,14 @@ class CamelRegistry(object):
             raise TypeError("Not a primitive node: {!r}".format(node))
         return constructor(data, version)
 
+    def run_raw_constructor(self, constructor, version, *yaml_args):
+        if len(yaml_args) == 3:
+            loader, suffix, node = yaml_args
+            version = int(suffix)
+        else:
+            loader, node = yaml_args
+        return constructor(loader, node, version)
+
     def inject_loaders(self, loader):
         for tag, versions in self.loaders.items():
             # "all" loader overrides everything
@@ -351,24 +2052,69 @@ class CamelRegistry(object):
 STANDARD_TYPES = CamelRegistry(tag_prefix=YAML_TAG_PREFIX)
 
 
-@STANDARD_TYPES.dumper(frozenset, 'set', version=None)
-def _dump_frozenset(data):
-    return dict.fromkeys(data)
+# These go straight between nodes and containers, rather than through an
+# intermediate list of one-item dicts or whatnot, since they're the sort of
+# thing that gets used for large amounts of data.
 
+def _check_node(node, node_type, what):
+    if not isinstance(node, node_type):
+        raise yaml.constructor.ConstructorError(
+            None, None,
+            "expected {0}, but found {1}".format(what, node.id),
+            node.start_mark)
 
-@STANDARD_TYPES.dumper(collections.OrderedDict, 'omap', version=None)
-def _dump_ordered_dict(data):
-    pairs = []
-    for key, value in data.items():
-        pairs.append({key: value})
-    return pairs
 
+def _sequence_node(dumper, tag):
+    # Make an empty sequence node and register it for aliasing, the same way
+    # pyyaml's represent_sequence does, so recursive structures still work
+    node = yaml.SequenceNode(tag, [], flow_style=False)
+    if dumper.alias_key is not None:
+        dumper.represented_objects[dumper.alias_key] = node
+    return node
 
-@STANDARD_TYPES.loader('omap', version=None)
-def _load_ordered_dict(data, version):
-    return collections.OrderedDict(
-        pair for datum in data for (pair,) in [datum.items()]
-    )
+
+@STANDARD_TYPES.dumper(frozenset, 'set', version=None, raw=True)
+def _dump_frozenset(dumper, data, tag):
+    node = yaml.MappingNode(tag, [], flow_style=False)
+    if dumper.alias_key is not None:
+        dumper.represented_objects[dumper.alias_key] = node
+    try:
+        data = sorted(data)
+    except TypeError:
+        pass
+    for item in data:
+        node.value.append((dumper.represent_data(item), dumper.represent_none(None)))
+    return node
+
+
+@STANDARD_TYPES.dumper(collections.OrderedDict, 'omap', version=None, raw=True)
+def _dump_ordered_dict(dumper, data, tag):
+    node = _sequence_node(dumper, tag)
+    for key, value in data.items():
+        node.value.append(yaml.MappingNode(
+            YAML_TAG_PREFIX + 'map',
+            [(dumper.represent_data(key), dumper.represent_data(value))],
+            flow_style=False,
+        ))
+    return node
+
+
+@STANDARD_TYPES.loader('omap', version=None, raw=True)
+def _load_ordered_dict(loader, node, version):
+    _check_node(node, yaml.SequenceNode, "a sequence")
+    data = collections.OrderedDict()
+    for subnode in node.value:
+        _check_node(subnode, yaml.MappingNode, "a mapping of length 1")
+        if len(subnode.value) != 1:
+            raise yaml.constructor.ConstructorError(
+                None, None,
+                "expected a single mapping item, but found {0} items"
+                .format(len(subnode.value)),
+                subnode.start_mark)
+        (key_node, value_node), = subnode.value
+        key = loader.construct_object(key_node, deep=True)
+        data[key] = loader.construct_object(value_node, deep=True)
+    return data
 
 
 # Extra Python types that don't have native YAML equivalents, but that PyYAML
@@ -380,14 +2126,18 @@ def _load_ordered_dict(data, version):
 PYTHON_TYPES = CamelRegistry(tag_prefix=YAML_TAG_PREFIX)
 
 
-@PYTHON_TYPES.dumper(tuple, 'python/tuple', version=None)
-def _dump_tuple(data):
-    return list(data)
+@PYTHON_TYPES.dumper(tuple, 'python/tuple', version=None, raw=True)
+def _dump_tuple(dumper, data, tag):
+    node = _sequence_node(dumper, tag)
+    node.value.extend(dumper.represent_data(item) for item in data)
+    return node
 
 
-@STANDARD_TYPES.loader('python/tuple', version=None)
-def _load_tuple(data, version):
-    return tuple(data)
+@STANDARD_TYPES.loader('python/tuple', version=None, raw=True)
+def _load_tuple(loader, node, version):
+    _check_node(node, yaml.SequenceNode, "a sequence")
+    return tuple(
+        loader.construct_object(subnode, deep=True) for subnode in node.value)
 
 
 @PYTHON_TYPES.dumper(complex, 'python/complex', version=None)
@@ -407,17 +2157,22 @@ def _load_complex(data, version):
     return complex(data)
 
 
-@PYTHON_TYPES.dumper(frozenset, 'python/frozenset', version=None)
-def _dump_frozenset(data):
+@PYTHON_TYPES.dumper(frozenset, 'python/frozenset', version=None, raw=True)
+def _dump_frozenset(dumper, data, tag):
+    node = _sequence_node(dumper, tag)
     try:
-        return list(sorted(data))
+        data = sorted(data)
     except TypeError:
-        return list(data)
+        pass
+    node.value.extend(dumper.represent_data(item) for item in data)
+    return node
 
 
-@STANDARD_TYPES.loader('python/frozenset', version=None)
-def _load_frozenset(data, version):
-    return frozenset(data)
+@STANDARD_TYPES.loader('python/frozenset', version=None, raw=True)
+def _load_frozenset(loader, node, version):
+    _check_node(node, yaml.SequenceNode, "a sequence")
+    return frozenset(
+        loader.construct_object(subnode, deep=True) for subnode in node.value)
 
 
 if hasattr(types, 'SimpleNamespace'):
@@ -433,3 +2188,9 @@ if hasattr(types, 'SimpleNamespace'):
 
 STANDARD_TYPES.freeze()
 PYTHON_TYPES.freeze()
+
+
+if sys.version_info < (3, 7):
+    # No module __getattr__, so the backend's classes can't be looked up
+    # lazily; load it now
+    _load_backend()
@@ -0,0 +1,624 @@
+# encoding: utf8
+"""The parts of camel built directly on pyyaml's classes.
+
+Importing yaml (and probing for its C extension) is most of what it costs to
+import camel, so this module isn't imported until something needs it; see
+`camel._load_backend`.  Everything public here is also available from
+`camel` itself.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+import base64
+import io
+from io import StringIO
+import re
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeDumper
+    from yaml import SafeLoader
+
+from camel import (
+    DEDUPE_THRESHOLD, INTERN_LIMIT, YAML_TAG_PREFIX, _bytes, _str)
+
+
+class CamelDumper(SafeDumper):
+    """Subclass of yaml's `SafeDumper` that scopes representers to the
+    instance, rather than to the particular class, because damn.
+
+    If `dedupe` is true, equal subtrees of at least `dedupe_threshold` nodes
+    are written once, with an anchor, and aliased thereafter.  Equality is
+    judged on the represented yaml nodes, so it happens after any registered
+    dumpers have had their say.  Note that this means the loaded data will
+    share those subtrees, even if the original data didn't.
+    """
+    # Set by Camel.dump_versions to share nodes between several dumpers
+    shared_nodes = None
+    # Set by IncrementalDumper to skip representing unchanged objects
+    fragments = None
+
+    def __init__(self, *args, **kwargs):
+        self.dedupe = kwargs.pop('dedupe', False)
+        self.dedupe_threshold = kwargs.pop('dedupe_threshold', DEDUPE_THRESHOLD)
+        index = kwargs.pop('index', None)
+        # TODO this isn't quite good enough; pyyaml still escapes anything
+        # outside the BMP
+        kwargs.setdefault('allow_unicode', True)
+        super(CamelDumper, self).__init__(*args, **kwargs)
+
+        if index is not None:
+            # Already contains everything below
+            self.yaml_representers = index.representers.copy()
+            self.yaml_multi_representers = index.multi_representers.copy()
+            return
+
+        self.yaml_representers = SafeDumper.yaml_representers.copy()
+        self.yaml_multi_representers = SafeDumper.yaml_multi_representers.copy()
+
+        # Always dump bytes as binary, even on Python 2
+        self.add_representer(bytes, CamelDumper.represent_binary)
+
+    def represent_binary(self, data):
+        # This is copy-pasted, because it only exists in pyyaml in python 3 (?!)
+        if hasattr(base64, 'encodebytes'):
+            data = base64.encodebytes(data).decode('ascii')
+        else:
+            data = base64.encodestring(data).decode('ascii')
+        return self.represent_scalar(
+            YAML_TAG_PREFIX + 'binary', data, style='|')
+
+    def add_representer(self, data_type, representer):
+        self.yaml_representers[data_type] = representer
+
+    def add_multi_representer(self, data_type, representer):
+        self.yaml_multi_representers[data_type] = representer
+
+    def represent_data(self, data):
+        if self.fragments is not None:
+            return self.fragments.represent_data(self, data)
+        if self.shared_nodes is None:
+            return super(CamelDumper, self).represent_data(data)
+        return self.shared_nodes.represent_data(self, data)
+
+    def represent(self, data):
+        node = self.represent_data(data)
+        if self.dedupe:
+            self.dedupe_nodes(node)
+        self.serialize(node)
+        self.represented_objects = {}
+        self.object_keeper = []
+        self.alias_key = None
+
+    def dedupe_nodes(self, root):
+        """Replace equal subtrees of the node graph with a single shared node,
+        which the serializer will then write out as an anchor and aliases.
+        """
+        # Hash-consing: every distinct structure gets a small integer id, and
+        # a collection's key is built from its children's ids, so each node
+        # only has to be looked at once
+        ids = {}  # structural key => id
+        canonical = {}  # id => first node seen with that structure
+        seen = {}  # id(node) => (structure id, size)
+        threshold = self.dedupe_threshold
+
+        def visit(node):
+            node_id = id(node)
+            if node_id in seen:
+                return seen[node_id]
+            # Placeholder, in case of recursive data; anything containing a
+            # cycle ends up with a key unique to that node
+            seen[node_id] = (('cycle', node_id), 1)
+
+            if isinstance(node, yaml.ScalarNode):
+                key = (node.tag, node.value, node.style)
+                size = 1
+            elif isinstance(node, yaml.SequenceNode):
+                children = []
+                size = 1
+                for i, child in enumerate(node.value):
+                    child_key, child_size = visit(child)
+                    node.value[i] = canonical.get(child_key, child)
+                    children.append(child_key)
+                    size += child_size
+                key = ('seq', node.tag, node.flow_style, tuple(children))
+            else:
+                children = []
+                size = 1
+                for i, (key_node, value_node) in enumerate(node.value):
+                    key_key, key_size = visit(key_node)
+                    value_key, value_size = visit(value_node)
+                    node.value[i] = (
+                        canonical.get(key_key, key_node),
+                        canonical.get(value_key, value_node),
+                    )
+                    children.append((key_key, value_key))
+                    size += key_size + value_size
+                key = ('map', node.tag, node.flow_style, tuple(children))
+
+            structure_id = ids.setdefault(key, len(ids))
+            if size >= threshold and not isinstance(node, yaml.ScalarNode):
+                canonical.setdefault(structure_id, node)
+            seen[node_id] = (structure_id, size)
+            return structure_id, size
+
+        visit(root)
+
+
+# Cache of combined implicit resolver regexes, keyed by the (tag, pattern,
+# flags) triples that went into them.  Every loader starts out with the same
+# resolvers, so this saves recompiling the same thing for every load.
+_combined_resolvers = {}
+_numbered_backref_rx = re.compile(r'\\[1-9]')
+
+
+def _combine_resolvers(resolvers):
+    """Turn a list of `(tag, regexp)` implicit resolvers into a single function
+    that takes a plain scalar value and returns the first matching tag, or
+    `None`.
+
+    Where possible, all the regexes are combined into one big alternation, so
+    resolving a scalar is a single regex match instead of one per resolver.
+    Alternation tries each branch in order, and every pyyaml resolver is
+    anchored at both ends, so the first branch that matches is the same
+    resolver that would've matched first when trying them one at a time.
+    """
+    key = tuple(
+        (tag, regexp.pattern, regexp.flags) for tag, regexp in resolvers)
+    try:
+        return _combined_resolvers[key]
+    except KeyError:
+        pass
+
+    if not resolvers:
+        def resolve(value):
+            return None
+        _combined_resolvers[key] = resolve
+        return resolve
+
+    parts = []
+    tags = {}
+    for i, (tag, regexp) in enumerate(resolvers):
+        pattern = regexp.pattern
+        # Bail on anything that might not survive being embedded in a larger
+        # regex: bytes, weird flags, numbered backreferences (which would be
+        # renumbered), or global inline flags
+        if (not isinstance(pattern, _str)
+                or regexp.flags & (getattr(re, 'ASCII', 0) | re.LOCALE)
+                or _numbered_backref_rx.search(pattern)
+                or pattern.startswith('(?') and pattern[2:3].isalpha()):
+            break
+        flags = ''.join(
+            letter for flag, letter in (
+                (re.IGNORECASE, 'i'), (re.MULTILINE, 'm'),
+                (re.DOTALL, 's'), (re.VERBOSE, 'x'))
+            if regexp.flags & flag)
+        if flags:
+            pattern = '(?{0}:{1})'.format(flags, pattern)
+        else:
+            pattern = '(?:{0})'.format(pattern)
+        name = '_r{0}'.format(i)
+        tags[name] = tag
+        parts.append('(?P<{0}>{1})'.format(name, pattern))
+    else:
+        try:
+            combined = re.compile('|'.join(parts))
+        except re.error:
+            combined = None
+
+        if combined is not None:
+            match = combined.match
+
+            def resolve(value):
+                m = match(value)
+                if m is None:
+                    return None
+                return tags[m.lastgroup]
+
+            _combined_resolvers[key] = resolve
+            return resolve
+
+    # Couldn't combine them, so do it the slow way
+    def resolve(value):
+        for tag, regexp in resolvers:
+            if regexp.match(value):
+                return tag
+        return None
+
+    _combined_resolvers[key] = resolve
+    return resolve
+
+
+class _SharedNodes(object):
+    """Cache of represented nodes shared between several `CamelDumper`s that
+    differ only in which versions of types they dump.
+
+    Whenever an object is represented and nothing in it has a type that the
+    dumpers disagree about, its node is remembered and reused by the other
+    dumpers, so only the parts of the data that actually differ get walked
+    more than once.
+    """
+    def __init__(self):
+        self.dumpers = []
+        # id(data) => (data, node); keeping the data alive means the id can't
+        # be reused by some temporary object
+        self.nodes = {}
+        # type => whether the dumpers disagree about it
+        self.varying_types = {}
+        # One flag per object currently being represented, true if anything
+        # inside it so far has a varying type
+        self.stack = []
+        # dumper => {id(data) => whether its node has a varying type in it},
+        # for objects that dumper has already walked
+        self.walked = {}
+
+    def type_varies(self, data_type):
+        try:
+            return self.varying_types[data_type]
+        except KeyError:
+            pass
+
+        representers = set()
+        for dumper in self.dumpers:
+            representers.add((
+                dumper.yaml_representers.get(data_type),
+                tuple(
+                    dumper.yaml_multi_representers.get(base)
+                    for base in data_type.__mro__),
+            ))
+        varies = self.varying_types[data_type] = len(representers) > 1
+        return varies
+
+    def represent_data(self, dumper, data):
+        key = id(data)
+        if key in self.nodes:
+            return self.nodes[key][1]
+
+        walked = self.walked.setdefault(dumper, {})
+        if key in dumper.represented_objects:
+            # pyyaml hands back the node it already made without looking
+            # inside, so pass on what was found the first time.  Objects still
+            # being walked (recursive ones) might vary, for all we know yet
+            if walked[key] and self.stack:
+                self.stack[-1] = True
+            return SafeDumper.represent_data(dumper, data)
+
+        walked[key] = True
+        self.stack.append(self.type_varies(type(data)))
+        try:
+            node = SafeDumper.represent_data(dumper, data)
+        finally:
+            varies = self.stack.pop()
+        walked[key] = varies
+
+        if varies:
+            if self.stack:
+                self.stack[-1] = True
+        elif not dumper.ignore_aliases(data):
+            # Objects that can't be aliased (scalars, mostly) are cheap, and
+            # sharing their nodes would make the serializer alias them
+            self.nodes[key] = (data, node)
+        return node
+
+
+class LimitExceeded(yaml.MarkedYAMLError):
+    """Raised when a document is bigger, deeper, or more aliased than a
+    `Camel`'s limits allow.
+    """
+
+
+class _LimitedStream(object):
+    """Wraps a stream being read by a `CamelLoader`, to keep an eye on how
+    much of it is read for a single document, and whether it might contain any
+    aliases.
+
+    The parser reads ahead in chunks, so this allows one chunk of slack; the
+    exact length is checked once the document has been composed.
+    """
+    def __init__(self, stream, loader):
+        self.stream = stream
+        self.loader = loader
+        self.name = getattr(stream, 'name', '<file>')
+        self.last_size = 0
+        self.last_had_star = False
+
+    def read(self, size=-1):
+        loader = self.loader
+        # Only give up if we'd gone over even before the last chunk
+        if (loader.max_bytes is not None
+                and loader._bytes_read - self.last_size > loader.max_bytes):
+            raise LimitExceeded(
+                problem="document is longer than {0} bytes"
+                .format(loader.max_bytes))
+        data = self.stream.read(size)
+        self.last_size = len(data)
+        loader._bytes_read += self.last_size
+        # Aliases can't happen without a *, and this is much cheaper than
+        # checking for them after the fact
+        self.last_had_star = (
+            ('*' if isinstance(data, _str) else b'*') in data)
+        if self.last_had_star:
+            loader._maybe_aliased = True
+        return data
+
+
+class CamelLoader(SafeLoader):
+    """Subclass of yaml's `SafeLoader` that scopes constructors to the
+    instance, rather than to the particular class, because damn.
+
+    Implicit resolvers are also scoped to the instance, and each first-character
+    bucket of them is compiled into a single regex the first time it's needed.
+
+    If `implicit_types` is false, plain scalars are never implicitly resolved,
+    so they all load as strings.  `string_hints` is a collection of plain
+    mapping keys that are known to be strings; they skip implicit resolution
+    entirely.  The same values elsewhere in a document resolve as usual.
+
+    `intern` controls deduplication of equal strings within a single load,
+    which saves a lot of memory for big lists of similar records.  It may be
+    `None` (don't), `'keys'` (string mapping keys), or `'all'` (every string).
+    At most `intern_limit` distinct strings are remembered.
+
+    `index` is a `_LoaderIndex` to take constructors from, instead of
+    starting with only the `SafeLoader` ones.
+
+    The remaining arguments limit the size of each document, and raise
+    `LimitExceeded` when they're exceeded, before anything is constructed:
+
+    - `max_bytes`: length of the document, in characters for text or bytes
+      otherwise.  Streams are read in chunks, so reading stops within a chunk
+      of the limit.
+    - `max_nodes`: number of distinct nodes.
+    - `max_depth`: how deeply nodes may be nested.  The C composer recurses
+      with no limit of its own, so this is also the only defense against
+      crashing it.
+    - `max_alias_expansion`: number of nodes the document would have if every
+      alias were replaced with a copy of what it refers to.  Documents that
+      refer to themselves recursively are rejected outright.  This is checked
+      after composing, but only if the document could contain an alias.
+
+    The first three are checked as the document is composed.
+    """
+    def __init__(
+            self, stream, implicit_types=True, string_hints=(),
+            intern=None, intern_limit=INTERN_LIMIT, index=None,
+            max_bytes=None, max_nodes=None, max_depth=None,
+            max_alias_expansion=None):
+        self.max_bytes = max_bytes
+        self.max_nodes = max_nodes
+        self.max_depth = max_depth
+        self.max_alias_expansion = max_alias_expansion
+        self._limited_stream = None
+        self._maybe_aliased = False
+        self._reset_limits()
+
+        if max_bytes is not None or max_alias_expansion is not None:
+            if isinstance(stream, _str):
+                stream = StringIO(stream)
+            elif isinstance(stream, _bytes):
+                stream = io.BytesIO(stream)
+            stream = self._limited_stream = _LimitedStream(stream, self)
+
+        super(CamelLoader, self).__init__(stream)
+        if index is not None:
+            self.yaml_constructors = index.constructors.copy()
+            self.yaml_multi_constructors = index.multi_constructors.copy()
+        else:
+            self.yaml_constructors = SafeLoader.yaml_constructors.copy()
+            self.yaml_multi_constructors = SafeLoader.yaml_multi_constructors.copy()
+        self.yaml_implicit_resolvers = SafeLoader.yaml_implicit_resolvers.copy()
+
+        self.implicit_types = implicit_types
+        self.string_hints = frozenset(string_hints)
+        # first character => combined resolver function
+        self._resolver_cache = {}
+        # Following the composer around costs two extra calls per node, so
+        # only do it if something needs to
+        if max_depth is not None:
+            self.descend_resolver = self._tracking_descend_resolver
+            self.ascend_resolver = self._tracking_ascend_resolver
+        elif self.string_hints:
+            self.descend_resolver = self._key_descend_resolver
+
+        if intern not in (None, 'keys', 'all'):
+            raise ValueError(
+                "intern must be None, 'keys', or 'all'; got {0!r}"
+                .format(intern))
+        self.intern = intern
+        self.intern_limit = intern_limit
+        self._intern_table = {}
+        if intern == 'all':
+            self.add_constructor(
+                YAML_TAG_PREFIX + 'str', CamelLoader.construct_interned_str)
+
+    def intern_string(self, value):
+        try:
+            return self._intern_table[value]
+        except KeyError:
+            if len(self._intern_table) < self.intern_limit:
+                self._intern_table[value] = value
+            return value
+
+    def construct_interned_str(self, node):
+        return self.intern_string(self.construct_scalar(node))
+
+    def construct_mapping(self, node, deep=False):
+        if self.intern and isinstance(node, yaml.MappingNode):
+            # Intern the keys on the nodes themselves, so they come out of
+            # construction already deduplicated
+            for key_node, _ in node.value:
+                if (key_node.tag == YAML_TAG_PREFIX + 'str'
+                        and isinstance(key_node, yaml.ScalarNode)):
+                    key_node.value = self.intern_string(key_node.value)
+        return super(CamelLoader, self).construct_mapping(node, deep=deep)
+
+    def add_constructor(self, data_type, constructor):
+        self.yaml_constructors[data_type] = constructor
+
+    def add_multi_constructor(self, data_type, constructor):
+        self.yaml_multi_constructors[data_type] = constructor
+
+    def add_implicit_resolver(self, tag, regexp, first):
+        if first is None:
+            first = [None]
+        for ch in first:
+            # Don't append in place; the lists are shared with SafeLoader
+            self.yaml_implicit_resolvers[ch] = (
+                self.yaml_implicit_resolvers.get(ch, []) + [(tag, regexp)])
+        self._resolver_cache.clear()
+
+    def add_path_resolver(self, *args, **kwargs):
+        # This API is non-trivial and claims to be experimental and unstable
+        raise NotImplementedError
+
+    # Limits
+
+    def _reset_limits(self):
+        self._bytes_read = 0
+        self._node_count = 0
+        self._depth = 0
+        self._resolving_key = False
+        # The next document might start in the chunk that was just read
+        if self._limited_stream is not None:
+            self._maybe_aliased = self._limited_stream.last_had_star
+
+    def get_node(self):
+        node = super(CamelLoader, self).get_node()
+        if node is None:
+            return node
+
+        if (self.max_bytes is not None
+                and node.end_mark.index - node.start_mark.index > self.max_bytes):
+            raise LimitExceeded(
+                None, None,
+                "document is longer than {0} bytes".format(self.max_bytes),
+                node.end_mark)
+
+        if self.max_alias_expansion is not None and self._maybe_aliased:
+            self.check_alias_expansion(node)
+
+        self._reset_limits()
+        return node
+
+    def check_alias_expansion(self, root):
+        """Complain if the node graph under `root` would be too big with all
+        its aliases expanded.  Each node is only visited once.
+        """
+        limit = self.max_alias_expansion
+        # id(node) => expanded size, or None if it's still being counted
+        sizes = {}
+        stack = [(root, False)]
+        while stack:
+            node, children_done = stack.pop()
+            if children_done:
+                size = 1
+                if isinstance(node, yaml.SequenceNode):
+                    for child in node.value:
+                        size += sizes[id(child)]
+                elif isinstance(node, yaml.MappingNode):
+                    for key, value in node.value:
+                        size += sizes[id(key)] + sizes[id(value)]
+                if size > limit:
+                    raise LimitExceeded(
+                        None, None,
+                        "document expands to more than {0} nodes".format(limit),
+                        node.start_mark)
+                sizes[id(node)] = size
+                continue
+
+            if id(node) in sizes:
+                if sizes[id(node)] is None:
+                    raise LimitExceeded(
+                        None, None,
+                        "found a recursive alias, which expands forever",
+                        node.start_mark)
+                continue
+
+            sizes[id(node)] = None
+            stack.append((node, True))
+            if isinstance(node, yaml.SequenceNode):
+                children = node.value
+            elif isinstance(node, yaml.MappingNode):
+                children = [child for pair in node.value for child in pair]
+            else:
+                continue
+            for child in children:
+                if sizes.get(id(child), 0) is None:
+                    raise LimitExceeded(
+                        None, None,
+                        "found a recursive alias, which expands forever",
+                        child.start_mark)
+                if id(child) not in sizes:
+                    stack.append((child, False))
+
+    def _tracking_descend_resolver(self, current_node, current_index):
+        # Replaces descend_resolver.  Called before composing every node, by
+        # both the C and Python composers, and matched by a call to
+        # ascend_resolver.  The node's own resolve always comes next, before
+        # any of its children's
+        if self.string_hints:
+            self._resolving_key = (
+                current_index is None
+                and isinstance(current_node, yaml.MappingNode))
+        if self.max_depth is not None:
+            self._depth += 1
+            if self._depth > self.max_depth:
+                raise LimitExceeded(
+                    None, None,
+                    "document is nested more than {0} levels deep"
+                    .format(self.max_depth),
+                    current_node.start_mark if current_node else None)
+        return super(CamelLoader, self).descend_resolver(
+            current_node, current_index)
+
+    def _key_descend_resolver(self, current_node, current_index):
+        # Replaces descend_resolver when only string_hints need it; the
+        # matching ascend_resolver has nothing to undo
+        self._resolving_key = (
+            current_index is None
+            and isinstance(current_node, yaml.MappingNode))
+        if self.yaml_path_resolvers:
+            super(CamelLoader, self).descend_resolver(
+                current_node, current_index)
+
+    def _tracking_ascend_resolver(self):
+        if self.max_depth is not None:
+            self._depth -= 1
+        return super(CamelLoader, self).ascend_resolver()
+
+    def resolve(self, kind, value, implicit):
+        # Called once for every distinct node, by both composers
+        if self.max_nodes is not None:
+            self._node_count += 1
+            if self._node_count > self.max_nodes:
+                raise LimitExceeded(
+                    problem="document has more than {0} nodes"
+                    .format(self.max_nodes))
+
+        if kind is yaml.ScalarNode and implicit[0]:
+            if not self.implicit_types or (
+                    self._resolving_key and value in self.string_hints):
+                return self.DEFAULT_SCALAR_TAG
+
+            first = value[:1]
+            try:
+                resolver = self._resolver_cache[first]
+            except KeyError:
+                resolver = self._resolver_cache[first] = _combine_resolvers(
+                    self.yaml_implicit_resolvers.get(first, [])
+                    + self.yaml_implicit_resolvers.get(None, []))
+
+            tag = resolver(value)
+            if tag is not None:
+                return tag
+            if not self.yaml_path_resolvers:
+                return self.DEFAULT_SCALAR_TAG
+            # Let pyyaml figure out the default
+            implicit = (False, implicit[1])
+
+        return super(CamelLoader, self).resolve(kind, value, implicit)
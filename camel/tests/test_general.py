@@ -5,10 +5,18 @@ from __future__ import print_function
 from __future__ import unicode_literals
 import collections
 import datetime
+import io
+import os
+import subprocess
+import sys
+import threading
 
 import pytest
+import yaml
 
-from camel import Camel, CamelRegistry, PYTHON_TYPES
+from camel import (
+    Camel, CamelLoader, CamelRegistry, ConfigStore, LimitExceeded,
+    PYTHON_TYPES, YAML_TAG_PREFIX)
 
 
 # Round-trips for simple values of built-in types
@@ -141,3 +149,880 @@ def test_dieroll2():
     dumped = camel.dump(value)
     assert dumped == '!roll\nnumdice: 3\nfaces: 6\n'
     assert camel.load(dumped) == value
+
+
+# -----------------------------------------------------------------------------
+# Implicit resolution
+
+@pytest.mark.parametrize('value', [
+    '', '~', 'null', 'yes', 'No', 'off', 'true', '0', '-12', '0x1f', '017',
+    '0b101', '1_000', '1:20', '1.5', '.5', '-.inf', '.NaN', '1.0e+5',
+    '2015-10-21', '2015-10-21 04:29:00', '<<', '=', 'abc', '1a', '-', '.',
+])
+def test_implicit_resolution_matches_pyyaml(value):
+    loader = CamelLoader('')
+    expected = yaml.SafeLoader('').resolve(yaml.ScalarNode, value, (True, False))
+    assert loader.resolve(yaml.ScalarNode, value, (True, False)) == expected
+
+
+def test_implicit_types_disabled():
+    camel = Camel(implicit_types=False)
+    assert camel.load("a: 1\nb: [true, null, 2015-10-21]\n") == {
+        'a': '1', 'b': ['true', 'null', '2015-10-21']}
+    # Explicit tags still work
+    assert camel.load("!!int 1") == 1
+
+
+def test_string_hints():
+    camel = Camel(string_hints=['yes', 'null', '1'])
+    assert camel.load("yes: no\nnull: 3\n") == {'yes': False, 'null': 3}
+    # Only keys are hinted, not the same values elsewhere
+    assert camel.load("a: yes\nb: [1, null]\nc: {1: yes}\n") == {
+        'a': True, 'b': [1, None], 'c': {'1': True}}
+    assert camel.load("yes") is True
+    # Key tracking works the same alongside the depth limit
+    limited = Camel(string_hints=['yes', 'null', '1'], max_depth=10)
+    assert limited.load("a: yes\nc: {1: yes}\n") == {'a': True, 'c': {'1': True}}
+
+
+def test_omap_nested_roundtrip():
+    shared = [1, 2]
+    value = collections.OrderedDict([
+        ('z', collections.OrderedDict([('y', shared)])),
+        ('a', shared),
+        ('m', (1, frozenset('ab'))),
+    ])
+    camel = Camel([PYTHON_TYPES])
+    dumped = camel.dump(value)
+    assert dumped == (
+        "!!omap\n"
+        "- z: !!omap\n"
+        "  - y: &id001\n"
+        "    - 1\n"
+        "    - 2\n"
+        "- a: *id001\n"
+        "- m: !!python/tuple\n"
+        "  - 1\n"
+        "  - !!python/frozenset\n"
+        "    - a\n"
+        "    - b\n"
+    )
+    loaded = camel.load(dumped)
+    assert loaded == value
+    assert loaded['z']['y'] is loaded['a']
+
+
+def test_omap_rejects_bad_structure():
+    camel = Camel()
+    with pytest.raises(yaml.constructor.ConstructorError):
+        camel.load("!!omap\n- a: 1\n  b: 2\n")
+    with pytest.raises(yaml.constructor.ConstructorError):
+        camel.load("!!omap {a: 1}\n")
+
+
+# Dump/load with raw nodes
+reg3 = CamelRegistry()
+
+
+@reg3.dumper(DieRoll, 'roll', version=None, raw=True)
+def dump_dice(dumper, data, tag):
+    return dumper.represent_sequence(tag, list(data), flow_style=True)
+
+
+@reg3.loader('roll', version=None, raw=True)
+def load_dice(loader, node, version):
+    return DieRoll(*loader.construct_sequence(node))
+
+
+def test_dieroll_raw():
+    value = DieRoll(3, 6)
+    camel = Camel([reg3])
+    dumped = camel.dump(value)
+    assert dumped == '!roll [3, 6]\n'
+    assert camel.load(dumped) == value
+
+
+# -----------------------------------------------------------------------------
+# Interning
+
+def test_intern_keys():
+    camel = Camel()
+    dumped = "- {name: a, kind: thing}\n- {name: b, kind: thing}\n"
+
+    loaded = camel.load(dumped)
+    (key1, _), = [k for k in loaded[0].items() if k[0] == 'name']
+    (key2, _), = [k for k in loaded[1].items() if k[0] == 'name']
+    assert key1 is not key2
+
+    loaded = camel.load(dumped, intern='keys')
+    keys1 = sorted(loaded[0])
+    keys2 = sorted(loaded[1])
+    assert all(k1 is k2 for k1, k2 in zip(keys1, keys2))
+    assert loaded[0]['kind'] is not loaded[1]['kind']
+
+    loaded = camel.load(dumped, intern='all')
+    assert loaded[0]['kind'] is loaded[1]['kind']
+    assert loaded == [{'name': 'a', 'kind': 'thing'}, {'name': 'b', 'kind': 'thing'}]
+
+
+def test_intern_limit():
+    camel = Camel()
+    loaded = camel.load("[aa, bb, aa, bb]", intern='all', intern_limit=1)
+    assert loaded[0] is loaded[2]
+    assert loaded[1] is not loaded[3]
+
+
+def test_intern_bad_value():
+    with pytest.raises(ValueError):
+        Camel().load("x", intern='everything')
+
+
+# -----------------------------------------------------------------------------
+# Deduplication
+
+def test_dedupe():
+    block = {'host': 'localhost', 'port': 80}
+    value = {'a': dict(block), 'b': dict(block), 'c': [1], 'd': [1]}
+    camel = Camel()
+    assert camel.dump(value) == (
+        "a:\n  host: localhost\n  port: 80\n"
+        "b:\n  host: localhost\n  port: 80\n"
+        "c:\n- 1\n"
+        "d:\n- 1\n"
+    )
+    dumped = camel.dump(value, dedupe=True)
+    # Small subtrees are left alone
+    assert dumped == (
+        "a: &id001\n  host: localhost\n  port: 80\n"
+        "b: *id001\n"
+        "c:\n- 1\n"
+        "d:\n- 1\n"
+    )
+    assert camel.load(dumped) == value
+
+    dumped = camel.dump(value, dedupe=True, dedupe_threshold=2)
+    assert dumped.count('*id') == 2
+    assert camel.load(dumped) == value
+
+
+def test_dedupe_after_dumpers():
+    # The dumper makes these equal, even though the values aren't
+    camel = Camel([reg2])
+    value = [DieRoll(3, 6), DieRoll(3, 6)]
+    dumped = camel.dump(value, dedupe=True)
+    assert dumped == "- &id001 !roll\n  numdice: 3\n  faces: 6\n- *id001\n"
+    assert camel.load(dumped) == value
+
+
+def test_dedupe_recursive():
+    value = [1, 2, 3]
+    value.append(value)
+    camel = Camel()
+    dumped = camel.dump([value, [1, 2, 3]], dedupe=True)
+    loaded = camel.load(dumped)
+    assert loaded[0][3] is loaded[0]
+    assert loaded[1] == [1, 2, 3]
+
+
+# -----------------------------------------------------------------------------
+# Dumping several versions at once
+
+class Chair(object):
+    def __init__(self, legs):
+        self.legs = legs
+
+
+chair_reg = CamelRegistry()
+
+
+@chair_reg.dumper(Chair, 'chair', version=1)
+def dump_chair_v1(chair):
+    return "{0} legs".format(chair.legs)
+
+
+@chair_reg.dumper(Chair, 'chair', version=2)
+def dump_chair_v2(chair):
+    return {'legs': chair.legs}
+
+
+def test_dump_versions():
+    shared = {'color': 'red', 'sizes': [1, 2, 3]}
+    value = {
+        'chairs': [Chair(4), Chair(3)],
+        'shared': shared,
+        'again': shared,
+        'other': [DieRoll(1, 20)],
+    }
+    camel = Camel([chair_reg, reg])
+    results = camel.dump_versions(value, {'old': {Chair: 1}, 'new': {Chair: 2}})
+    assert list(results) == ['old', 'new']
+
+    for name, version in [('old', 1), ('new', 2)]:
+        single = Camel([chair_reg, reg])
+        single.lock_version(Chair, version)
+        assert results[name] == single.dump(value)
+    assert "!chair;1 4 legs" in results['old']
+    assert "!chair;2\n" in results['new']
+
+
+def test_dump_versions_aliased_versioned_types():
+    chairs = [Chair(4)]
+    nested = {'chairs': chairs, 'plain': [1, 2]}
+    documents = [
+        [chairs, chairs],
+        {'a': nested, 'b': nested, 'c': [nested]},
+        [[chairs], [chairs, {'x': chairs}]],
+    ]
+    camel = Camel([chair_reg])
+    for value in documents:
+        results = camel.dump_versions(
+            value, {'old': {Chair: 1}, 'new': {Chair: 2}})
+        for name, version in [('old', 1), ('new', 2)]:
+            single = Camel([chair_reg])
+            single.lock_version(Chair, version)
+            assert results[name] == single.dump(value)
+
+
+# -----------------------------------------------------------------------------
+# Registry indexing
+
+def test_conflicting_loaders():
+    with pytest.raises(ValueError):
+        Camel([reg, reg2])
+
+    # The Camel is still usable after a failed add_registry
+    camel = Camel([reg])
+    with pytest.raises(ValueError):
+        camel.add_registry(reg2)
+    assert reg2 not in camel.registries
+    assert camel.load('!roll 3d6') == DieRoll(3, 6)
+
+
+def test_override_standard_loaders():
+    override_reg = CamelRegistry(tag_prefix=YAML_TAG_PREFIX)
+
+    @override_reg.loader('omap', version=None)
+    def _load_omap(data, version):
+        return 'custom'
+
+    assert Camel([override_reg]).load('!!omap []') == 'custom'
+
+
+def test_index_is_rebuilt():
+    late_reg = CamelRegistry()
+    camel = Camel([late_reg])
+    index = camel.get_loader_index()
+    assert camel.get_loader_index() is index
+
+    # Registries can still be added to after they're given to a Camel
+    @late_reg.dumper(DieRoll, 'roll', version=None)
+    def dump_dice(data):
+        return "{}d{}".format(*data)
+
+    @late_reg.loader('roll', version=None)
+    def load_dice(data, version):
+        a, _, b = data.partition('d')
+        return DieRoll(int(a), int(b))
+
+    assert camel.get_loader_index() is not index
+    assert camel.load(camel.dump(DieRoll(2, 4))) == DieRoll(2, 4)
+
+
+# -----------------------------------------------------------------------------
+# Files and compression
+
+@pytest.mark.parametrize('filename', ['data.yaml', 'data.yaml.gz', 'data.yaml.bz2', 'data.yaml.xz'])
+def test_file_roundtrip(tmpdir, filename):
+    path = str(tmpdir.join(filename))
+    documents = [{'n': n, 'roll': DieRoll(n, 6)} for n in range(1, 4)]
+    camel = Camel([reg])
+    camel.dump_all_file(iter(documents), path)
+    assert list(camel.load_all_file(path)) == documents
+
+    # Compression is sniffed from the contents, not the filename
+    with open(path, 'rb') as f:
+        raw = f.read()
+    with open(str(tmpdir.join('renamed')), 'wb') as f:
+        f.write(raw)
+    assert list(camel.load_all_file(str(tmpdir.join('renamed')))) == documents
+
+
+def test_file_objects():
+    camel = Camel()
+    buf = io.BytesIO()
+    camel.dump_file({'x': [1, 2]}, buf, compression='bz2')
+    assert buf.getvalue().startswith(b'BZh')
+    assert not buf.closed
+
+    buf.seek(0)
+    assert camel.load_file(buf) == {'x': [1, 2]}
+
+    with pytest.raises(ValueError):
+        camel.dump_file({}, io.BytesIO(), compression='zip')
+
+
+def test_file_paths_and_streams(tmpdir):
+    import pathlib
+    camel = Camel()
+    path = pathlib.Path(str(tmpdir.join('data.yaml.gz')))
+    camel.dump_file({'x': 1}, path)
+    assert camel.load_file(path) == {'x': 1}
+
+    # A pipe can't be seeked, but its compression can still be sniffed
+    read_fd, write_fd = os.pipe()
+    with io.open(write_fd, 'wb') as f:
+        f.write(path.read_bytes())
+    with io.open(read_fd, 'rb', buffering=0) as pipe:
+        assert camel.load_file(pipe) == {'x': 1}
+        assert not pipe.closed
+
+    with pytest.raises(TypeError):
+        camel.load_file(io.StringIO('x: 1'))
+    with pytest.raises(TypeError):
+        camel.dump_file({'x': 1}, io.StringIO())
+
+
+def test_dump_error_leaves_file_open():
+    import gc
+    buf = io.BytesIO()
+    with pytest.raises(yaml.YAMLError):
+        Camel().dump_all_file([{'x': 1}, object()], buf)
+    gc.collect()
+    assert not buf.closed
+    assert buf.getvalue().startswith(b'x: 1')
+
+
+# -----------------------------------------------------------------------------
+# Resource limits
+
+def test_max_depth():
+    camel = Camel(max_depth=3)
+    assert camel.load("[[1]]") == [[1]]
+    with pytest.raises(LimitExceeded):
+        camel.load("[[[1]]]")
+    # Deep enough to crash pyyaml's C composer, if it got that far
+    with pytest.raises(LimitExceeded):
+        camel.load("[" * 200000 + "]" * 200000)
+
+
+def test_max_nodes():
+    camel = Camel(max_nodes=4)
+    assert camel.load("[1, 2, 3]") == [1, 2, 3]
+    with pytest.raises(LimitExceeded):
+        camel.load("[1, 2, 3, 4]")
+
+
+def test_max_bytes():
+    camel = Camel(max_bytes=10)
+    assert camel.load("[1, 2, 3]\n") == [1, 2, 3]
+    with pytest.raises(LimitExceeded):
+        camel.load("[1, 2, 3, 4]\n")
+    # Limits are per document
+    assert list(camel.load_all("[1, 2, 3]\n---\n[1, 2, 3]\n")) == [[1, 2, 3]] * 2
+
+
+def test_max_alias_expansion():
+    bomb = (
+        "a: &a [lol, lol, lol, lol, lol, lol, lol, lol, lol]\n"
+        "b: &b [*a, *a, *a, *a, *a, *a, *a, *a, *a]\n"
+        "c: &c [*b, *b, *b, *b, *b, *b, *b, *b, *b]\n"
+        "d: &d [*c, *c, *c, *c, *c, *c, *c, *c, *c]\n"
+    )
+    assert len(Camel(max_alias_expansion=10000).load(bomb)) == 4
+    with pytest.raises(LimitExceeded):
+        Camel(max_alias_expansion=1000).load(bomb)
+
+    with pytest.raises(LimitExceeded):
+        Camel(max_alias_expansion=1000).load("&a [1, *a]")
+    # Without the limit, recursive data is fine
+    loaded = Camel().load("&a [1, *a]")
+    assert loaded[1] is loaded
+
+
+# -----------------------------------------------------------------------------
+# JSON fast path
+
+JSON_DOCUMENTS = [
+    '{}', '[]', '[{}, [], [[]]]', '{"a":1,"b":[1,2]}', ' \r\n\t{"a": {"b": null, "c": true}}\n',
+    '{"a": 1, "a": 2}', '{"": false}', '[1,\t2]', '[1,\n\t2]', '[1]\n\t', '[1]\t', '\t[1]',
+    '[0, -0, 12345678901234567890123, 1.0, -0.0, 0.1e-2, 1.5e+10]',
+    '[1e5, 1.5e10, 1E+5, 1.5E-5]',
+    '["\\/", "\\b\\f\\n\\r\\t", "a\\"b", "\\u00e9", "\\u0000", "\\u2028"]',
+    '["2015-10-21", "yes", "null", "1", "~", "<<"]',
+    '{"2015-10-21": "x", "1.5": 3}',
+    '["\\ud83d\\ude00"]', '["\\ud800"]', '["\x7f"]', '["\x85"]', '["café"]',
+    '["a\u2028 b"]', '["a\u2029 b"]', '{"a\u2028": 1}',
+    '[NaN]', '[Infinity]', '{"a": 1,}', '{a: 1}', '[1, 2',
+    '{"a"\n: 1}', '{"a"\r\n: 1}', '{"a" : 1}', '["a"\n, "b"]',
+    '{"%s": 1}' % ('a' * 1022), '{"%s": 1}' % ('a' * 1023),
+    '{"%s": 1}' % ('\\"' * 512), '{"a\\\\": 1, "%s": 2}' % ('b' * 1023),
+]
+
+
+def _load_outcome(camel, document):
+    try:
+        return 'ok', camel.load(document)
+    except Exception as e:
+        return 'error', type(e)
+
+
+@pytest.mark.parametrize('document', JSON_DOCUMENTS)
+def test_json_fast_path_matches_yaml(document):
+    assert (_load_outcome(Camel(json_fast_path=True), document)
+            == _load_outcome(Camel(), document))
+    hints = ['1', '1.0', 'true', 'null', 'a', '2015-10-21']
+    assert (_load_outcome(Camel(json_fast_path=True, string_hints=hints), document)
+            == _load_outcome(Camel(string_hints=hints), document))
+
+
+def test_json_fast_path_random():
+    import json
+    import random
+    rng = random.Random(18)
+    scalars = [
+        lambda: rng.randint(-10 ** 20, 10 ** 20),
+        lambda: rng.uniform(-1e6, 1e6),
+        lambda: rng.choice([True, False, None]),
+        lambda: ''.join(rng.choice('ab1.:-# \n"\\é\u2028') for _ in range(rng.randint(0, 8))),
+    ]
+
+    def make(depth):
+        if depth > 3 or rng.random() < 0.3:
+            return rng.choice(scalars)()
+        if rng.random() < 0.5:
+            return [make(depth + 1) for _ in range(rng.randint(0, 4))]
+        return {
+            rng.choice(scalars[3:])(): make(depth + 1)
+            for _ in range(rng.randint(0, 4))}
+
+    fast = Camel(json_fast_path=True)
+    slow = Camel()
+    for _ in range(200):
+        document = json.dumps([make(0)], ensure_ascii=rng.random() < 0.5)
+        assert _load_outcome(fast, document) == _load_outcome(slow, document)
+
+
+def test_json_fast_path_is_used():
+    camel = Camel(json_fast_path=True)
+
+    def make_loader(*args, **kwargs):
+        raise AssertionError("should've used the json module")
+    camel.make_loader = make_loader
+    assert camel.load('{"a": [1, 2.5, "x"]}') == {'a': [1, 2.5, 'x']}
+    assert list(camel.load_all('[1]')) == [[1]]
+
+
+def test_json_fast_path_respects_settings():
+    document = '[1, true]'
+    assert Camel(json_fast_path=True, implicit_types=False).load(document) == ['1', 'true']
+    assert Camel(json_fast_path=True, string_hints=['1']).load(document) == [1, True]
+
+
+# -----------------------------------------------------------------------------
+# Frozen documents
+
+FROZEN_DOCUMENT = """
+base: &base {x: 1, y: 2.5}
+merged:
+  <<: *base
+  z: [true, null, 2015-10-21, "ⓤ"]
+rolls: [!roll 3d6, !roll 1d20]
+shared: *base
+big: 123456789012345678901234
+dup: 1
+dup: 2
+2: two
+omap: !!omap [{b: 1}, {a: 2}]
+"""
+
+
+def test_frozen_document():
+    from camel import FrozenMapping, FrozenSequence
+    camel = Camel([reg])
+    frozen = camel.load_frozen(FROZEN_DOCUMENT)
+    root = frozen.root
+    assert isinstance(root, FrozenMapping)
+    assert isinstance(root['rolls'], FrozenSequence)
+    assert root == camel.load(FROZEN_DOCUMENT)
+    assert list(root) == ['base', 'merged', 'rolls', 'shared', 'big', 'dup', 2, 'omap']
+
+    assert root['merged']['x'] == 1
+    assert root['merged']['z'][-1] == 'ⓤ'
+    assert root[2] == 'two'
+    assert 'nope' not in root
+    assert root['merged'].get('nope') is None
+    with pytest.raises(IndexError):
+        root['rolls'][2]
+
+    # Custom types are only constructed once
+    assert root['rolls'][0] == DieRoll(3, 6)
+    assert root['rolls'][0] is root['rolls'][0]
+
+    # Read-only
+    with pytest.raises(TypeError):
+        root['dup'] = 3
+
+
+def test_frozen_document_sorted_keys():
+    camel = Camel()
+    data = {'k{0}'.format(i): i for i in range(100)}
+    data['ü'] = 'umlaut'
+    root = camel.load_frozen(camel.dump(data)).root
+    for key, value in data.items():
+        assert root[key] == value
+    assert 'k100' not in root
+    assert 5 not in root
+
+
+@pytest.mark.parametrize('document', [
+    "1: a\n0x1: b\n", "~: a\nnull: b\n", "1: a\ntrue: b\n",
+    "a: 1\n!!str a: 2\n", "1: a\n'1': b\n",
+])
+def test_frozen_document_duplicate_keys(document):
+    camel = Camel()
+    root = camel.load_frozen(document).root
+    assert dict(root.items()) == camel.load(document)
+    for key, value in camel.load(document).items():
+        assert root[key] == value
+
+
+def test_frozen_document_recursive():
+    root = Camel().load_frozen("&a [1, *a]").root
+    assert root[1][1][0] == 1
+
+
+def test_frozen_document_shared_memory():
+    pytest.importorskip('multiprocessing.shared_memory')
+    from camel import FrozenDocument
+    camel = Camel([reg])
+    frozen = camel.load_frozen(FROZEN_DOCUMENT)
+    shm = frozen.share()
+    try:
+        attached, attached_shm = FrozenDocument.attach(shm.name, camel)
+        assert attached.root['rolls'][1] == DieRoll(1, 20)
+        attached.close()
+        attached_shm.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+PATCH_DOCUMENT = """\
+# Settings
+name: camel  # the name
+rolls:
+- !roll 3d6
+- !roll 1d20
+nested:
+  flow: {a: 1, b: [1, 2]}
+  block:
+    x: 1
+    y: 2
+# end of nested
+text: |
+  line one
+  line two
+notes:
+- a
+- >-
+  folded
+
+- c
+last: true
+"""
+
+
+@pytest.mark.parametrize(('path', 'value'), [
+    (['name'], 'dromedary'),
+    (['rolls', 1], DieRoll(2, 8)),
+    (['rolls'], [DieRoll(1, 4)]),
+    (['nested', 'flow', 'b', 0], 'multi\nline'),
+    (['nested', 'block'], {'z': [1, 2]}),
+    (['text'], 'short'),
+    (['notes', 1], 'b'),
+    (['notes'], ['d']),
+    (['last'], None),
+])
+def test_patch(path, value):
+    camel = Camel([reg])
+    patched = camel.patch(PATCH_DOCUMENT, path, value)
+
+    expected = camel.load(PATCH_DOCUMENT)
+    target = expected
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = value
+    assert camel.load(patched) == expected
+
+    # Everything else is left alone
+    assert patched.startswith('# Settings\n')
+    assert '# end of nested\n' in patched
+    if path != ['name']:
+        assert 'name: camel  # the name\n' in patched
+
+
+def test_patch_empty_values():
+    camel = Camel()
+    assert camel.patch("a:\nb: 2\n", ['a'], [1]) == "a: [1]\nb: 2\n"
+    assert camel.patch("-\n- 2\n", [0], 'x') == "- x\n- 2\n"
+    assert camel.patch("a: 1\n", [], {'b': 2}) == "{b: 2}\n"
+
+
+def test_patch_errors():
+    camel = Camel()
+    with pytest.raises(KeyError):
+        camel.patch("a: 1\n", ['b'], 2)
+    with pytest.raises(IndexError):
+        camel.patch("[1, 2]", [2], 2)
+    with pytest.raises(ValueError):
+        camel.patch("a: &x {b: 1}\nc: *x\n", ['c', 'b'], 2)
+    with pytest.raises(ValueError):
+        camel.patch("a: &x 1\nc: *x\n", ['a'], 2)
+
+
+def test_patch_file(tmpdir):
+    path = str(tmpdir.join('settings.yaml'))
+    with io.open(path, 'w', encoding='utf8', newline='') as f:
+        f.write("# ü\r\nname: camel\r\nrolls: [!roll 3d6]\r\nlast: true\r\n")
+    camel = Camel([reg])
+    camel.patch_file(path, ['rolls', 0], DieRoll(1, 20))
+    with io.open(path, 'r', encoding='utf8', newline='') as f:
+        assert f.read() == (
+            "# ü\r\nname: camel\r\nrolls: [!roll 1d20]\r\nlast: true\r\n")
+    assert tmpdir.listdir() == [tmpdir.join('settings.yaml')]
+
+    # The line breaks after a block scalar are kept, even across chunks
+    with io.open(path, 'w', encoding='utf8', newline='') as f:
+        f.write("text: |\n" + "  line\n" * 20000 + "\nlast: true\n")
+    camel.patch_file(path, ['text'], 'short')
+    with io.open(path, 'r', encoding='utf8', newline='') as f:
+        assert f.read() == "text: short\n\nlast: true\n"
+
+
+class Section(object):
+    def __init__(self, entries):
+        self.entries = entries
+        self.camel_version = 0
+
+
+section_reg = CamelRegistry()
+
+
+@section_reg.dumper(Section, 'section', version=1)
+def _dump_section(section):
+    return section.entries
+
+
+def test_incremental_dump():
+    camel = Camel([section_reg])
+    inner = Section([{'x': 1}, 'multi\nline', 'y' * 100])
+    state = {
+        'plain': {'a': 1},
+        'nested': Section({'inner': inner, 'list': [[1, 2]]}),
+        'items': [Section({'b': 2}), Section([])],
+    }
+    dumper = camel.incremental_dumper()
+    assert dumper.dump(state) == camel.dump(state)
+
+    # Unchanged
+    assert dumper.dump(state) == camel.dump(state)
+
+    # Changes to unversioned data are always picked up
+    state['plain']['a'] = 2
+    assert dumper.dump(state) == camel.dump(state)
+
+    # Versioned objects inside other versioned objects are checked too
+    inner.entries.append('z')
+    inner.camel_version += 1
+    assert dumper.dump(state) == camel.dump(state)
+
+    # Without a version bump, the old text is reused
+    state['items'][0].entries['b'] = 3
+    assert 'b: 2' in dumper.dump(state)
+    state['items'][0].camel_version += 1
+    assert dumper.dump(state) == camel.dump(state)
+
+
+def test_incremental_dump_fallbacks():
+    camel = Camel([section_reg])
+    shared = Section({'a': 1})
+    state = {'one': shared}
+    dumper = camel.incremental_dumper()
+    assert dumper.dump(state) == camel.dump(state)
+
+    # Shared objects need anchors
+    state['two'] = shared
+    assert dumper.dump(state) == camel.dump(state)
+    assert '&id001' in dumper.dump(state)
+
+    # Somewhere cached text can't go
+    del state['two']
+    state['flow'] = (shared,)
+    assert dumper.dump(state) == camel.dump(state)
+
+    # As the whole document
+    assert dumper.dump(shared) == camel.dump(shared)
+    assert dumper.dump(shared) == camel.dump(shared)
+
+
+def test_config_store(tmpdir):
+    path = str(tmpdir.join('config.yaml'))
+    other = str(tmpdir.join('other.yaml'))
+    tmpdir.join('config.yaml').write("a: 1\n")
+    tmpdir.join('other.yaml').write("b: 2\n")
+
+    store = ConfigStore(Camel())
+    changes = []
+    store.subscribe(lambda *args: changes.append(args))
+    config = store.get(path)
+    assert config == {'a': 1}
+    assert store.get(path) is config
+    assert store.get(other) == {'b': 2}
+    assert store.check() == []
+
+    tmpdir.join('config.yaml').write("a: 10\n")
+    os.utime(path, (0, 0))
+    assert store.check() == [path]
+    assert store.get(path) == {'a': 10}
+    assert changes == [(path, {'a': 1}, {'a': 10})]
+    snapshot = store.snapshot()
+    assert snapshot == {path: {'a': 10}, other: {'b': 2}}
+    with pytest.raises(TypeError):
+        snapshot[path] = {}
+
+    # Bad files keep the old data
+    tmpdir.join('other.yaml').write("b: [\n")
+    assert store.check() == []
+    assert store.get(other) == {'b': 2}
+    assert isinstance(store.errors[other], yaml.YAMLError)
+
+
+def test_config_store_on_error_can_use_store(tmpdir):
+    path = str(tmpdir.join('config.yaml'))
+    other = str(tmpdir.join('other.yaml'))
+    tmpdir.join('config.yaml').write("a: 1\n")
+    tmpdir.join('other.yaml').write("b: 2\n")
+
+    def on_error(filename, exception):
+        store.forget(filename)
+        store.get(other)
+    store = ConfigStore(Camel(), on_error=on_error)
+    store.get(path)
+    tmpdir.join('config.yaml').write("a: [\n")
+
+    # Used to deadlock, since on_error was called with the lock held
+    thread = threading.Thread(target=store.check)
+    thread.daemon = True
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert path not in store
+    assert store.errors == {}
+    assert store.snapshot() == {other: {'b': 2}}
+
+
+def test_config_store_thread(tmpdir):
+    path = str(tmpdir.join('config.yaml'))
+    tmpdir.join('config.yaml').write("a: 1\n")
+
+    changed = threading.Event()
+    with ConfigStore(Camel(), interval=0.01) as store:
+        store.subscribe(lambda *args: changed.set())
+        assert store.get(path) == {'a': 1}
+        tmpdir.join('config.yaml').write("a: 2\n")
+        os.utime(path, (0, 0))
+        assert changed.wait(5)
+    assert store.get(path) == {'a': 2}
+    assert store.thread is None
+
+
+# Import time
+
+# Microseconds; importing camel currently takes about a tenth of this
+IMPORT_TIME_BUDGET = 50000
+
+
+def _run_python(code, tmpdir, *args):
+    env = dict(os.environ)
+    # Measure with bytecode cached, as it would be when installed
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPYCACHEPREFIX'] = str(tmpdir.join('pycache'))
+    env['PYTHONPATH'] = os.path.dirname(os.path.dirname(
+        os.path.dirname(os.path.abspath(__file__))))
+    process = subprocess.Popen(
+        [sys.executable] + list(args) + ['-c', code], env=env,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True)
+    stdout, stderr = process.communicate()
+    assert process.returncode == 0, stderr
+    return stdout, stderr
+
+
+@pytest.mark.skipif(
+    sys.version_info < (3, 8), reason="needs -X importtime and PYTHONPYCACHEPREFIX")
+def test_import_time(tmpdir):
+    # yaml isn't imported until it's needed
+    stdout, _ = _run_python(
+        "import sys, camel; "
+        "print(' '.join(sorted(set(sys.modules) & set(["
+        "'yaml', 'json', 'gzip', 'bz2', 'lzma', 'tempfile', 'uuid', 're']))))",
+        tmpdir)
+    assert stdout.strip() == ''
+    stdout, _ = _run_python(
+        "import sys, camel; camel.Camel(); print('yaml' in sys.modules)",
+        tmpdir)
+    assert stdout.strip() == 'True'
+
+    # Best of a few runs, to allow for noise
+    timings = []
+    for _ in range(3):
+        _, stderr = _run_python("import camel", tmpdir, '-X', 'importtime')
+        for line in stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == 'camel':
+                timings.append(int(fields[1]))
+    assert len(timings) == 3
+    assert min(timings) < IMPORT_TIME_BUDGET
+
+
+# Progress
+
+def test_load_all_progress():
+    camel = Camel()
+    text = ''.join("--- {{a: {0}}}\n".format(i) for i in range(5))
+    reports = []
+
+    def progress(p):
+        reports.append((p.documents, p.bytes))
+        assert p.document_time >= 0
+        assert p.elapsed >= p.document_time
+        if p.documents == 3:
+            p.cancel()
+
+    documents = list(camel.load_all(text, progress=progress))
+    assert documents == [{'a': 0}, {'a': 1}, {'a': 2}]
+    assert [documents for documents, _ in reports] == [1, 2, 3]
+    assert reports[-1][1] == len(text)
+
+
+def test_dump_all_file_progress():
+    camel = Camel()
+    reports = []
+
+    def progress(p):
+        reports.append((p.documents, p.bytes, p.document_bytes))
+        if p.documents == 2:
+            p.cancel()
+
+    buf = io.BytesIO()
+    camel.dump_all_file(({'ü': i} for i in range(5)), buf, progress=progress)
+    assert buf.getvalue() == "ü: 0\n---\nü: 1\n".encode('utf8')
+    assert reports == [(1, 6, 6), (2, 16, 10)]
+
+    # And back again, with the same callback
+    del reports[:]
+    buf.seek(0)
+    assert list(camel.load_all_file(buf, progress=progress)) == [
+        {'ü': 0}, {'ü': 1}]
+    assert [documents for documents, _, _ in reports] == [1, 2]
+    assert reports[-1][1] == 16